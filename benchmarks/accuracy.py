@@ -0,0 +1,219 @@
+"""
+File contains the accuracy-versus-latency regression harness for fast inference paths.
+
+Every candidate path is run on a fixed, seeded corpus of waveforms next to the reference
+float32 model, and its relative P and H errors are checked against per-material tolerances.
+
+Usage (from the repository root):
+    python benchmarks/accuracy.py --materials N87 3C90
+    python benchmarks/accuracy.py --candidates magnethub --strict --out accuracy.json
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import argparse
+import sys
+
+from time import perf_counter
+
+import numpy as np
+
+from common import (MATERIALS, RESOLUTION, SHAPES, TEAMS, environment_info, generate_waveforms,
+                    load_team_model, save_results)
+
+# Default relative tolerances of the candidate paths against the reference path
+TOLERANCE = {"P": 0.02, "H": 0.05}
+
+# Per-material overrides of the default tolerances
+MAT_TOLERANCE = {}
+
+
+def load_magnethub(team, material):
+    """Load the packaged MagNet Toolkit model served by the GUI."""
+    import magnethub as mh
+    return mh.loss.LossModel(material, team.lower())
+
+
+def option_loader(**options):
+    """Return a loader of the team models with constructor options (raises ValueError if rejected)."""
+    def load(team, material):
+        return load_team_model(team, material, **options)
+    return load
+
+
+# Candidate inference paths, each given by the teams it supports and a loader (team, material) -> model
+CANDIDATES = {
+    "magnethub": {"teams": TEAMS, "load": load_magnethub},
+    "bfloat16": {"teams": TEAMS, "load": option_loader(precision="bfloat16")},
+    "int8": {"teams": ["Paderborn"], "load": option_loader(precision="int8")},
+    "onnxruntime": {"teams": TEAMS, "load": option_loader(backend="onnxruntime")},
+}
+
+
+def tolerance(material):
+    """
+    Return the P and H tolerances of a material.
+
+    Args:
+        material (string): The name of the material.
+    """
+    return {**TOLERANCE, **MAT_TOLERANCE.get(material, {})}
+
+
+def build_corpus(team, n_per_shape, seed):
+    """
+    Build the fixed waveform corpus of a team.
+
+    Args:
+        team (string): The name of the team.
+        n_per_shape (int): The number of waveforms per waveform shape.
+        seed (int): The seed of the corpus.
+    """
+    parts = [generate_waveforms(shape, n_per_shape, RESOLUTION[team], seed=seed + i)
+             for i, shape in enumerate(SHAPES)]
+    return tuple(np.concatenate(part) for part in zip(*parts))
+
+
+def timed_call(mdl, B, F, T, repeat):
+    """
+    Call a model repeatedly and return its outputs and median latency.
+
+    Args:
+        mdl (object): The model instance.
+        B (np.array): The flux density batch in T.
+        F (np.array): The frequency in Hz.
+        T (np.array): The temperature in °C.
+        repeat (int): The number of timed calls.
+    """
+    P, H = mdl(B, F, T)  # untimed warm-up call
+    latencies = []
+    for _ in range(repeat):
+        start = perf_counter()
+        P, H = mdl(B, F, T)
+        latencies.append(perf_counter() - start)
+    P = np.atleast_1d(np.asarray(P, dtype=np.float64))
+    H = np.asarray(H, dtype=np.float64).reshape(B.shape[0], -1)
+    return P, H, float(np.median(latencies))
+
+
+def relative_errors(P, H, P_ref, H_ref):
+    """
+    Compute the relative P error and the peak-normalized H error of every waveform.
+
+    Args:
+        P (np.array): The candidate loss density.
+        H (np.array): The candidate field strength.
+        P_ref (np.array): The reference loss density.
+        H_ref (np.array): The reference field strength.
+    """
+    err_P = np.abs(P - P_ref) / np.abs(P_ref)
+    err_H = np.max(np.abs(H - H_ref), axis=1) / np.max(np.abs(H_ref), axis=1)
+    return err_P, err_H
+
+
+def pareto_front(rows):
+    """
+    Flag the rows that no other row beats in both latency and P error.
+
+    Args:
+        rows (list): The result rows of one team and material.
+    """
+    for row in rows:
+        row["pareto"] = not any(
+            other is not row
+            and other["latency_s"] <= row["latency_s"]
+            and other["P_err_max"] <= row["P_err_max"]
+            and (other["latency_s"] < row["latency_s"] or other["P_err_max"] < row["P_err_max"])
+            for other in rows)
+    return rows
+
+
+def run(args):
+    """
+    Evaluate the reference and all selected candidates per team and material.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    rows = []
+    for team in args.teams:
+        B, F, T = build_corpus(team, args.n_per_shape, args.seed)
+        for material in args.materials:
+            P_ref, H_ref, latency_ref = timed_call(load_team_model(team, material), B, F, T, args.repeat)
+            tol = tolerance(material)
+            group = [{
+                "team": team, "material": material, "path": "reference",
+                "latency_s": latency_ref, "speedup": 1.0,
+                "P_err_max": 0.0, "P_err_p95": 0.0, "H_err_max": 0.0, "H_err_p95": 0.0,
+                "passed": True,
+            }]
+            for name in args.candidates:
+                candidate = CANDIDATES[name]
+                if team not in candidate["teams"]:
+                    continue
+                try:
+                    mdl = candidate["load"](team, material)
+                except ValueError as error:
+                    # The model refused to activate the path on its own validation data
+                    print(f"{team} {material} {name}: {error}")
+                    continue
+                P, H, latency = timed_call(mdl, B, F, T, args.repeat)
+                err_P, err_H = relative_errors(P, H, P_ref, H_ref)
+                group.append({
+                    "team": team, "material": material, "path": name,
+                    "latency_s": latency, "speedup": latency_ref / latency,
+                    "P_err_max": float(err_P.max()), "P_err_p95": float(np.percentile(err_P, 95)),
+                    "H_err_max": float(err_H.max()), "H_err_p95": float(np.percentile(err_H, 95)),
+                    "passed": bool(err_P.max() <= tol["P"] and err_H.max() <= tol["H"]),
+                })
+            rows += pareto_front(group)
+    return rows
+
+
+def print_table(rows):
+    """
+    Print the accuracy/latency Pareto table.
+
+    Args:
+        rows (list): The result rows.
+    """
+    header = (f"{'team':9s} {'material':8s} {'path':18s} {'latency[ms]':>11s} {'speedup':>8s} "
+              f"{'P err max':>10s} {'P err p95':>10s} {'H err max':>10s} {'H err p95':>10s} {'pareto':>6s}  status")
+    print(header)
+    print("-" * len(header))
+    for row in sorted(rows, key=lambda r: (r["team"], r["material"], r["latency_s"])):
+        print(f"{row['team']:9s} {row['material']:8s} {row['path']:18s} {row['latency_s'] * 1e3:11.2f} "
+              f"{row['speedup']:7.2f}x {row['P_err_max']:10.2e} {row['P_err_p95']:10.2e} "
+              f"{row['H_err_max']:10.2e} {row['H_err_p95']:10.2e} {'*' if row['pareto'] else '':>6s}  "
+              f"{'PASS' if row['passed'] else 'FAIL'}")
+
+
+def main():
+    """
+    Harness entry point.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", nargs="+", default=TEAMS, choices=TEAMS)
+    parser.add_argument("--materials", nargs="+", default=MATERIALS, choices=MATERIALS)
+    parser.add_argument("--candidates", nargs="+", default=list(CANDIDATES), choices=list(CANDIDATES))
+    parser.add_argument("--n-per-shape", type=int, default=32, help="corpus waveforms per waveform shape")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per path")
+    parser.add_argument("--seed", type=int, default=2023)
+    parser.add_argument("--out", help="JSON file to store the results in")
+    parser.add_argument("--strict", action="store_true", help="exit with an error if any candidate fails")
+    args = parser.parse_args()
+
+    rows = run(args)
+    print_table(rows)
+    if args.out:
+        save_results(args.out, {"environment": environment_info(), "config": vars(args),
+                                "tolerance": {m: tolerance(m) for m in args.materials}, "records": rows})
+
+    if args.strict and not all(row["passed"] for row in rows):
+        sys.exit(1)
+
+
+# Main program
+if __name__ == "__main__":
+    main()
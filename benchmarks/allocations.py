@@ -0,0 +1,178 @@
+"""
+File contains the allocation benchmark of the steady-state call path of the team models.
+
+Repeated calls with the same batch shape should reuse the per-material constants and, with out=
+buffers, write P and H in place. For the calls after the warm-up it reports:
+    numpy peak     peak NumPy and pandas memory above the start of the call (tracemalloc)
+    torch bytes    bytes allocated by the torch allocator (torch.profiler with profile_memory)
+    torch allocs   number of allocations of the torch allocator
+
+and checks the steady state, exiting with an error when a check fails:
+    growth         no call allocates more than the first measured one (numpy peak, torch bytes and
+                   allocations, within --tolerance)
+    in place       with out=, P and H are returned in the buffers, and materializing H allocates at
+                   least the bytes of H less than without out= (H is not allocated and then copied)
+
+Usage (from the repository root, CPU only, no network access needed):
+    python benchmarks/allocations.py
+    python benchmarks/allocations.py --materials N87 3C90 --batch-sizes 1 100 --out allocations.json
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import argparse
+import inspect
+import sys
+import tracemalloc
+
+import numpy as np
+import torch
+
+from torch.profiler import ProfilerActivity, profile
+
+from common import RESOLUTION, TEAMS, environment_info, generate_waveforms, load_team_model, save_results
+
+# Allocations below this size in bytes are not told apart from those of the interpreter (frames, small objects)
+SLACK = 64 * 1024
+# The same for the output stage alone, which runs little Python (NumPy casting buffers, small objects)
+OUTPUT_SLACK = 16 * 1024
+
+
+def measure(call, prepare=None):
+    """
+    Measure the allocations of one call, tracemalloc and the profiler in separate calls.
+
+    Args:
+        call (function): The call, receiving the value of prepare.
+        prepare (function): Builds the argument of each call outside the measurement, optional.
+    """
+    prepare = prepare or (lambda: None)
+    value = prepare()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    call(value)
+    numpy_peak = tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    value = prepare()
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        call(value)
+    # Every allocation of the torch allocator is one positive [memory] event of the raw trace, the
+    # per-operator attribution of prof.events() misses some of them
+    allocations = [event.nbytes() for event in prof.profiler.kineto_results.events()
+                   if event.name() == "[memory]" and event.nbytes() > 0]
+    return {"numpy_peak": numpy_peak, "torch_bytes": int(sum(allocations)), "torch_allocs": len(allocations)}
+
+
+def allocated(measurement):
+    """The bytes allocated by NumPy (peak) and torch in a measurement."""
+    return measurement["numpy_peak"] + measurement["torch_bytes"]
+
+
+def growth(calls, tolerance):
+    """
+    Name the figures that grow over the measured calls.
+
+    Args:
+        calls (list): The measurements of consecutive calls.
+        tolerance (float): The relative growth over the first call that is accepted.
+    """
+    return [key for key in ("numpy_peak", "torch_bytes", "torch_allocs")
+            if max(call[key] for call in calls[1:]) > calls[0][key] * (1 + tolerance) + (key != "torch_allocs") * SLACK]
+
+
+def check_in_place(mdl, B, F, T, out):
+    """
+    Check that the out= path writes P and H into the buffers without allocating output arrays.
+
+    H is materialized on its own through loss_only, so the allocations of the output stage are
+    compared without the preprocessing and network stages, which are the same with and without out=.
+    Intermediates of the post-processing (the smoothing of the Sydney model) are allocated either way.
+
+    Args:
+        mdl: A team model supporting out=.
+        B, F, T: The inputs of the call.
+        out (tuple): The buffers of P and H.
+
+    Return:
+        The measurements of the output stage with and without out=, and the failed checks.
+    """
+    failures = []
+    p, h = mdl(B, F, T, out=out)
+    if p is not out[0] or h is not out[1]:
+        failures.append("results not returned in the out= buffers")
+    stage = {mode: measure(lambda prediction: prediction.h, lambda: mdl(B, F, T, loss_only=True, **kwargs))
+             for mode, kwargs in (("fresh", {}), ("out", {"out": out}))}
+    saved = allocated(stage["fresh"]) - allocated(stage["out"])
+    if saved < out[1].nbytes - OUTPUT_SLACK:
+        failures.append(f"H allocated and copied into out= ({saved} of {out[1].nbytes} bytes saved)")
+    return stage, failures
+
+
+def run(args):
+    """
+    Measure every team, material and batch size, with and without out= buffers.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+
+    Return:
+        The records and the failed checks.
+    """
+    records, failures = [], []
+    for team in args.teams:
+        for material in args.materials:
+            mdl = load_team_model(team, material)
+            supports_out = "out" in inspect.signature(mdl.__call__).parameters
+            for batch_size in args.batch_sizes:
+                B, F, T = generate_waveforms("trapezoidal", batch_size, RESOLUTION[team], seed=args.seed)
+                out = (np.empty(batch_size, dtype=np.float32), np.empty(B.shape, dtype=np.float32))
+                case = f"{team} {material} batch={batch_size}"
+                for mode in ["fresh", "out"] if supports_out else ["fresh"]:
+                    kwargs = {"out": out} if mode == "out" else {}
+                    for _ in range(args.warmup):
+                        mdl(B, F, T, **kwargs)
+                    calls = [measure(lambda _: mdl(B, F, T, **kwargs)) for _ in range(args.calls)]
+                    record = {"team": team, "material": material, "batch_size": batch_size, "mode": mode,
+                              **calls[0], "calls": calls}
+                    grown = growth(calls, args.tolerance) if len(calls) > 1 else []
+                    failures += [f"{case} {mode}: {key} grows over {args.calls} calls" for key in grown]
+                    if mode == "out":
+                        record["h_stage"], failed = check_in_place(mdl, B, F, T, out)
+                        failures += [f"{case}: {failure}" for failure in failed]
+                    records.append(record)
+                    print(f"{team:9s} {material:5s} batch={batch_size:<6d} {mode:5s} "
+                          f"numpy peak {record['numpy_peak']/1e3:10.1f} kB  "
+                          f"torch {record['torch_bytes']/1e3:10.1f} kB in {record['torch_allocs']:5d} allocations")
+    return records, failures
+
+
+def main():
+    """
+    Command line entry point.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", nargs="+", default=TEAMS, choices=TEAMS)
+    parser.add_argument("--materials", nargs="+", default=["N87"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 100, 1000])
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured calls before the measured ones")
+    parser.add_argument("--calls", type=int, default=3, help="measured calls per case, compared for growth")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="relative growth over the first call accepted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)  # the intra-op pool would add its own allocations
+    records, failures = run(args)
+    results = {"environment": environment_info(), "records": records, "failures": failures}
+    if args.out:
+        save_results(args.out, results)
+
+    print(f"\nSteady-state checks: {len(failures)} failed")
+    for failure in failures:
+        print(f"  FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+File contains the latency and throughput benchmark of the Paderborn and Sydney core loss models.
+
+Usage (from the repository root, CPU only, no network access needed):
+    python benchmarks/bench_models.py --out bench.json
+    python benchmarks/bench_models.py --materials N87 --batch-sizes 1 100 --compare bench.json
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import argparse
+import sys
+
+from time import perf_counter
+
+import numpy as np
+import torch
+
+from common import (MATERIALS, RESOLUTION, SHAPES, TEAMS, environment_info, generate_waveforms,
+                    load_results, load_team_model, save_results)
+from runtime import ThreadTopology, parse_cores
+
+# Paderborn runs a batch at once (about 5 GB of resident memory per 20k rows), pass 100000 explicitly
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+
+
+class StageTimer:
+    """
+    Accumulate the wall time spent in the pipeline stages of a team model.
+
+    The stages are measured by temporarily wrapping the module-level preprocessing functions
+    and the network of a model instance, so the models themselves stay untouched.
+
+    Parameters:
+    - mdl: the model instance (PaderbornModel or SydneyModel)
+    - team: the name of the team
+    """
+
+    def __init__(self, mdl, team):
+        self.mdl = mdl
+        self.team = team
+        self.times = {}
+        self._patched = []
+
+    def _wrap(self, stage, func):
+        """Return `func` accumulating its run time into `stage`."""
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[stage] = self.times.get(stage, 0.0) + perf_counter() - start
+        return timed
+
+    def _patch(self, owner, name, stage):
+        """Replace `owner.name` with its timed version."""
+        original = getattr(owner, name)
+        self._patched.append((owner, name, original))
+        setattr(owner, name, self._wrap(stage, original))
+
+    def __enter__(self):
+        module = sys.modules[type(self.mdl).__module__]
+        if self.team == 'Paderborn':
+            self._patch(module, 'engineer_features', 'features')
+            self._patch(module, 'construct_tensor_seq2seq', 'tensors')
+            self._patch(self.mdl, 'mdl', 'network')
+        else:
+            self._patch(module, 'get_dataloader', 'dataloader')
+            # MMINet, or the ONNX Runtime session standing in for it (smoothing of H counts as 'other')
+            self._patch(type(self.mdl.mdl), 'forward_raw', 'network')
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+
+
+def bench_case(mdl, team, B, F, T, repeat, warmup):
+    """
+    Time repeated model calls on one batch.
+
+    Args:
+        mdl (object): The model instance.
+        team (string): The name of the team.
+        B (np.array): The flux density batch in T.
+        F (np.array): The frequency in Hz.
+        T (np.array): The temperature in °C.
+        repeat (int): The number of timed calls.
+        warmup (int): The number of untimed calls before the measurement.
+    """
+    for _ in range(warmup):
+        mdl(B, F, T)
+
+    latencies = []
+    stages = {}
+    for _ in range(repeat):
+        with StageTimer(mdl, team) as timer:
+            start = perf_counter()
+            mdl(B, F, T)
+            latencies.append(perf_counter() - start)
+        # The remainder of the call is post-processing and glue code
+        timer.times['other'] = latencies[-1] - sum(timer.times.values())
+        for stage, value in timer.times.items():
+            stages.setdefault(stage, []).append(value)
+
+    latencies = np.array(latencies)
+    return {
+        "latency_s": {
+            "min": float(latencies.min()),
+            "median": float(np.median(latencies)),
+            "mean": float(latencies.mean()),
+            "max": float(latencies.max()),
+        },
+        "throughput_per_s": float(B.shape[0] / np.median(latencies)),
+        "stages_s": {stage: float(np.median(values)) for stage, values in stages.items()},
+    }
+
+
+def run(args):
+    """
+    Sweep teams, materials, waveform shapes, thread counts and batch sizes.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    records = []
+    ThreadTopology(inter_op=args.inter_op_threads, cores=args.cores).apply()
+    for team in args.teams:
+        for material in args.materials:
+            for threads in args.threads:
+                with ThreadTopology(intra_op=threads, cores=args.cores).scope():
+                    # Loaded within the scope, so that ONNX Runtime sessions use the same threads
+                    mdl = load_team_model(team, material, precision=args.precision, backend=args.backend)
+                    for shape in args.shapes:
+                        for batch_size in args.batch_sizes:
+                            B, F, T = generate_waveforms(shape, batch_size, RESOLUTION[team], seed=args.seed)
+                            result = bench_case(mdl, team, B, F, T, args.repeat, args.warmup)
+                            record = {
+                                "team": team,
+                                "material": material,
+                                "precision": args.precision,
+                                "backend": args.backend,
+                                "shape": shape,
+                                "threads": threads,
+                                "batch_size": batch_size,
+                                **result,
+                            }
+                            records.append(record)
+                            print(f"{team:9s} {material:5s} {shape:11s} threads={threads:<2d} batch={batch_size:<6d} "
+                                  f"median={record['latency_s']['median'] * 1e3:10.2f} ms "
+                                  f"throughput={record['throughput_per_s']:10.1f}/s", flush=True)
+    return records
+
+
+def saturation(records, fraction=0.95):
+    """
+    Find the thread count at which the throughput of every case saturates.
+
+    Args:
+        records (list): The benchmark records.
+        fraction (float): The share of the peak throughput regarded as saturated.
+    """
+    groups = {}
+    for record in records:
+        key = case_key(record)
+        groups.setdefault(key[:-2] + key[-1:], []).append(record)
+
+    summary = []
+    for key, group in groups.items():
+        if len(group) < 2:
+            continue
+        group = sorted(group, key=lambda record: record["threads"])
+        peak = max(record["throughput_per_s"] for record in group)
+        saturated = next(record for record in group if record["throughput_per_s"] >= fraction * peak)
+        summary.append({
+            "case": list(key),
+            "peak_throughput_per_s": peak,
+            "saturation_threads": saturated["threads"],
+            "throughput_by_threads": {record["threads"]: record["throughput_per_s"] for record in group},
+        })
+        print("{} {} {} {} {} batch={}: saturates at {} threads ({:.1f}/s, peak {:.1f}/s)".format(
+            *key, saturated["threads"], saturated["throughput_per_s"], peak))
+    return summary
+
+
+def case_key(record):
+    """Identify a benchmark case independently of its results."""
+    return (record["team"], record["material"], record.get("precision", "float32"),
+            record.get("backend", "torch"), record["shape"], record["threads"], record["batch_size"])
+
+
+def compare(records, baseline, threshold):
+    """
+    Print the latency ratio of every case against a stored baseline run.
+
+    Args:
+        records (list): The current benchmark records.
+        baseline (dictionary): The stored results of a previous run.
+        threshold (float): The relative slowdown reported as a regression.
+
+    Return:
+        The number of regressed cases.
+    """
+    reference = {case_key(record): record for record in baseline["records"]}
+    print(f"\nComparison against {baseline['environment'].get('commit')} (regression threshold {threshold:.0%})")
+    regressions = 0
+    for record in records:
+        old = reference.get(case_key(record))
+        if old is None:
+            continue
+        ratio = record["latency_s"]["median"] / old["latency_s"]["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{} {} {} {} {} threads={} batch={}: {:.2f}x{}".format(*case_key(record), ratio, flag))
+    return regressions
+
+
+def main():
+    """
+    Benchmark entry point.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", nargs="+", default=TEAMS, choices=TEAMS)
+    parser.add_argument("--materials", nargs="+", default=MATERIALS, choices=MATERIALS)
+    parser.add_argument("--shapes", nargs="+", default=SHAPES, choices=SHAPES)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=BATCH_SIZES)
+    parser.add_argument("--threads", nargs="+", type=int, default=[torch.get_num_threads()])
+    parser.add_argument("--inter-op-threads", type=int, help="process-wide inter-op threads")
+    parser.add_argument("--cores", type=parse_cores, help="cores to pin the benchmark to, e.g. 0-3")
+    parser.add_argument("--precision", default="float32", choices=["float32", "bfloat16", "int8"],
+                        help="inference precision of the models (validated against float32 at load time)")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnxruntime"],
+                        help="runtime of the networks (validated against PyTorch at load time)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per case")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed calls per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON file to store the results in")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown flagged as regression")
+    args = parser.parse_args()
+
+    records = run(args)
+    if len(args.threads) > 1:
+        print("\nThroughput saturation (95% of the peak)")
+    results = {"environment": environment_info(), "config": vars(args), "records": records,
+               "saturation": saturation(records)}
+    if args.out:
+        save_results(args.out, results)
+
+    if args.compare:
+        regressions = compare(records, load_results(args.compare), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+# Main program
+if __name__ == "__main__":
+    main()
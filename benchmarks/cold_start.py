@@ -0,0 +1,188 @@
+"""
+File contains the cold start benchmark of the GUI and the team models.
+
+Every measurement runs in a fresh interpreter, like a new container of the deployment:
+    imports           import time of the modules imported by app.py (python -X importtime)
+    first render      from the process start until the page configuration, the first element of the page
+    first prediction  from the process start until the first page run, including the default prediction, is done
+    team modules      import time of the Paderborn and Sydney modules, and the time until their first prediction
+
+Usage (from the repository root, CPU only, no network access needed):
+    python benchmarks/cold_start.py --out cold_start.json
+    python benchmarks/cold_start.py --repeat 5 --compare cold_start.json
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from os.path import abspath, dirname, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+SRC = join(ROOT, "src")
+
+# Measured in the child processes; the output is one JSON line of the marks in s since the process start
+APP_CHILD = """
+import sys, time, json
+start = float(sys.argv[1])
+sys.path.insert(0, {src!r})
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+marks = {{}}
+set_page_config = st.set_page_config
+def first_render(*args, **kwargs):
+    marks.setdefault("first_render", time.time() - start)
+    return set_page_config(*args, **kwargs)
+st.set_page_config = first_render
+app = AppTest.from_file({app!r}, default_timeout=600)
+app.run()
+marks["first_prediction"] = time.time() - start
+marks["exceptions"] = [str(e.value) for e in app.exception]
+print(json.dumps(marks))
+"""
+
+TEAM_CHILD = """
+import sys, time, json
+start = float(sys.argv[1])
+sys.path.insert(0, {team_dir!r})
+import numpy as np
+module = __import__({team!r})
+marks = {{"import": time.time() - start}}
+mdl = getattr(module, {team!r} + "Model")({model_path!r}, "N87")
+marks["load"] = time.time() - start
+mdl(0.1*np.sin(np.linspace(0, 2*np.pi, 1024, endpoint=False)), 100e3, 25)
+marks["first_prediction"] = time.time() - start
+print(json.dumps(marks))
+"""
+
+
+def run_child(code, *args):
+    """
+    Run the code of a measurement in a fresh interpreter from the repository root.
+
+    Args:
+        code (string): The Python code, printing its marks as the last line of JSON.
+        *args (string): Extra command line arguments after the process start.
+    """
+    start = time.time()
+    result = subprocess.run([sys.executable, "-c", code, repr(start), *args], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(module, top=10):
+    """
+    Profile the imports of a module with python -X importtime in a fresh interpreter.
+
+    Only the modules imported directly by the module are listed. A package imported by several of
+    them counts for the first one only.
+
+    Args:
+        module (string): The module name, importable from src.
+        top (int): The number of modules kept, by cumulative import time.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=SRC,
+                            capture_output=True, text=True, check=True)
+    direct, total = {}, None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented by two spaces per level and listed before their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                total = int(cumulative) / 1e6
+                break
+            direct = {}
+        elif depth == 1:
+            direct[name.strip()] = int(cumulative) / 1e6
+    ranked = sorted(direct.items(), key=lambda item: -item[1])[:top]
+    return {"total": total, "modules": dict(ranked)}
+
+
+def median_marks(runs):
+    """Median of every numeric mark over several runs."""
+    keys = [key for key, value in runs[0].items() if isinstance(value, (int, float))]
+    return {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in keys}
+
+
+def run(args):
+    """
+    Run the cold start measurements.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    results = {"imports": import_profile("app", args.top)}
+    print(f"import app: {results['imports']['total']:.2f} s")
+    for name, seconds in results["imports"]["modules"].items():
+        print(f"  {name:28s} {seconds:6.3f} s")
+
+    app_runs = [run_child(APP_CHILD.format(src=SRC, app=join(SRC, "app.py"))) for _ in range(args.repeat)]
+    for marks in app_runs:
+        if marks["exceptions"]:
+            print(f"app raised: {marks['exceptions']}")
+    results["app"] = median_marks(app_runs)
+    print("app: first render {first_render:.2f} s, first prediction {first_prediction:.2f} s".format(**results["app"]))
+
+    results["teams"] = {}
+    for team in args.teams:
+        team_dir = join(SRC, "teams", team)
+        code = TEAM_CHILD.format(team_dir=team_dir, team=team, model_path=join(team_dir, "models", "N87.pt"))
+        runs = [run_child(code) for _ in range(args.repeat)]
+        results["teams"][team] = median_marks(runs)
+        print("{}: import {import:.2f} s, loaded {load:.2f} s, first prediction {first_prediction:.2f} s".format(
+            team, **results["teams"][team]))
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print the cold start times against a previous run.
+
+    Args:
+        results (dictionary): The current results.
+        baseline (dictionary): The results of the previous run.
+    """
+    print(f"\nComparison against {baseline['environment'].get('commit')}")
+    rows = [("import app", baseline["imports"]["total"], results["imports"]["total"])]
+    rows += [(f"app {key}", baseline["app"][key], results["app"][key]) for key in results["app"]]
+    rows += [(f"{team} {key}", baseline["teams"][team][key], marks[key])
+             for team, marks in results["teams"].items() if team in baseline["teams"] for key in marks]
+    for name, before, after in rows:
+        print(f"{name:28s} {before:6.2f} s -> {after:6.2f} s ({after/before:.2f}x)")
+
+
+def main():
+    """
+    Command line entry point.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", nargs="+", default=["Paderborn", "Sydney"], choices=["Paderborn", "Sydney"])
+    parser.add_argument("--repeat", type=int, default=3, help="fresh processes per measurement, the median is kept")
+    parser.add_argument("--top", type=int, default=10, help="modules listed in the import profile")
+    parser.add_argument("--out", help="JSON file to store the results in")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare against")
+    args = parser.parse_args()
+
+    # The helpers import torch, which is measured in the child processes only
+    from common import environment_info, load_results, save_results
+
+    results = run(args)
+    results["environment"] = environment_info()
+    if args.compare:
+        compare(results, load_results(args.compare))
+    if args.out:
+        save_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+File contains shared helpers for the offline benchmarks of the team models.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from datetime import datetime, timezone
+from os.path import abspath, dirname, join
+
+import numpy as np
+
+# Make the GUI helpers and the team models importable without installation
+ROOT = dirname(dirname(abspath(__file__)))
+SRC = join(ROOT, "src")
+TEAMS_DIR = join(SRC, "teams")
+for path in (SRC, join(TEAMS_DIR, "Paderborn"), join(TEAMS_DIR, "Sydney")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import torch
+
+from utils import generateTriSequence, generateTrapSequence
+
+TEAMS = ['Paderborn', 'Sydney']
+MATERIALS = ['3C90', '3C92', '3C94', '3C95', '3E6',
+             '3F4', '77', '78', '79', 'ML95S',
+             'N27', 'N30', 'N49', 'N87', 'T37']
+SHAPES = ['sine', 'triangular', 'trapezoidal']
+RESOLUTION = {
+    "Sydney": 128,
+    "Paderborn": 1024,
+}  # Model resolution
+
+
+def load_team_model(team, material, **kwargs):
+    """
+    Load a team model from the local `teams` folder.
+
+    Args:
+        team (string): The name of the team (Paderborn or Sydney).
+        material (string): The name of the material.
+        **kwargs (dictionary): Extra keyword arguments for the model constructor.
+    """
+    mdl_path = join(TEAMS_DIR, team, "models", material + ".pt")
+    if team == 'Paderborn':
+        from Paderborn import PaderbornModel
+        return PaderbornModel(mdl_path, material, **kwargs)
+    if team == 'Sydney':
+        from Sydney import SydneyModel
+        return SydneyModel(mdl_path, material, **kwargs)
+    raise ValueError(f"Team '{team}' not supported. Must be in {', '.join(TEAMS)}")
+
+
+def generate_waveforms(shape, batch_size, resolution, seed=0, n_unique=64):
+    """
+    Generate a seeded batch of synthetic excitations with the GUI waveform generators.
+
+    A pool of at most `n_unique` distinct waveforms is generated and tiled with random amplitudes,
+    so that large batches do not spend their time in the scalar generators.
+
+    Args:
+        shape (string): The waveform shape (sine, triangular or trapezoidal).
+        batch_size (int): The number of waveforms.
+        resolution (int): The number of samples per cycle.
+        seed (int): The seed of the random parameter draw.
+        n_unique (int): The number of distinct waveform shapes in the pool.
+
+    Return:
+        B (np.array): The flux density in T with shape (batch_size, resolution).
+        F (np.array): The frequency in Hz with shape (batch_size,).
+        T (np.array): The temperature in °C with shape (batch_size,).
+    """
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, resolution)
+
+    # Generate the waveform pool normalized to unit amplitude
+    n_pool = min(n_unique, batch_size)
+    pool = np.empty((n_pool, resolution))
+    for i in range(n_pool):
+        phase = rng.uniform(0, 360)
+        if shape == 'sine':
+            pool[i] = np.sin((360 * t + phase) * np.pi / 180)
+        elif shape == 'triangular':
+            pool[i] = generateTriSequence(t, 1.0, phase, rng.uniform(0.1, 0.9))
+        elif shape == 'trapezoidal':
+            duty1 = rng.uniform(0.1, 0.5)
+            duty2 = rng.uniform(0.1, 0.9 - duty1)
+            pool[i] = generateTrapSequence(t, 1.0, phase, duty1, duty2)
+        else:
+            raise ValueError(f"Shape '{shape}' not supported. Must be in {', '.join(SHAPES)}")
+
+    # Tile the pool and draw the operating points (B in [10, 300] mT, f in [50, 450] kHz)
+    B = pool[rng.integers(0, n_pool, batch_size)] * rng.uniform(0.01, 0.3, (batch_size, 1))
+    F = rng.uniform(50e3, 450e3, batch_size)
+    T = rng.choice([25.0, 50.0, 70.0, 90.0], batch_size)
+    return B, F, T
+
+
+def environment_info():
+    """
+    Collect the software and hardware information attached to every benchmark result.
+
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(path, results):
+    """
+    Store benchmark results as JSON.
+
+    Args:
+        path (string): The output file.
+        results (dictionary): The results including the environment information.
+    """
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path):
+    """
+    Load benchmark results stored by `save_results`.
+
+    Args:
+        path (string): The result file.
+    """
+    with open(path, "r") as file:
+        return json.load(file)
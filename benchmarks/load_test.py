@@ -0,0 +1,342 @@
+"""
+File contains the local load test of the GUI inference path.
+
+N simulated sessions run concurrently in one process, like the sessions of one deployed worker.
+Each session owns a LatestOnlyExecutor on the shared thread pool of the app and calls the prediction
+function of app.py the way a page rerun does (see app.get_prediction), so the debouncing, the
+dropping of superseded requests, the shared model cache and the memoization of the app are all
+exercised. A session alternates think
+times with user actions:
+    drag       a slider moves to a new value in unit steps, one rerun per step at the drag rate
+    step       frequency or temperature is changed by typing a new value (one rerun)
+    material   another material is selected
+    model      the other model is selected
+    shape      another waveform shape is selected
+
+The report holds the latency percentiles of the completed requests and of the settled states (from
+the last rerun of an action until its prediction is shown), the throughput, the share of dropped
+requests, and the resident memory, threads and throughput over time. Once the sessions stopped, every
+distinct page state is predicted again sequentially, without the memoization, and the results
+served to the sessions are checked against this reference: concurrent sessions sharing a model
+must not return wrong values, however fast they are.
+
+Usage (from the repository root, Linux, no network access needed once the models are cached):
+    python benchmarks/load_test.py --sessions 8 --duration 60
+    python benchmarks/load_test.py --sessions 32 --ramp 10 --no-cache --out load.json
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import argparse
+import logging
+import random
+import threading
+
+from concurrent.futures import CancelledError, TimeoutError
+from functools import lru_cache
+from time import monotonic, sleep
+
+import numpy as np
+
+from common import MATERIALS, RESOLUTION, TEAMS, environment_info, save_results  # puts src on the path
+
+import app
+
+from background import LatestOnlyExecutor
+from runtime import ThreadTopology
+
+# Slider and input ranges of the page (see app.main)
+RANGES = {
+    "amplitude": (10, 300),
+    "phase": (0, 360),
+    "duty": (1, 99),
+    "frequency": (10, 450),
+    "temperature": (25, 90),
+}
+SLIDERS = {0: ["amplitude", "phase"], 1: ["amplitude", "phase", "duty"], 2: ["amplitude", "phase", "duty"]}
+
+
+def rss():
+    """The resident memory of the process in bytes (Linux)."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class Session:
+    """
+    One simulated user of the page.
+
+    Parameters:
+    - index: number of the session, seeds its actions
+    - args: the parsed command line arguments
+    - predict: the prediction function of the app
+    - stop: event ending the session
+    - executor: the thread pool shared by the sessions
+    """
+
+    def __init__(self, index, args, predict, stop, executor):
+        self.random = random.Random(args.seed + index)
+        self.args = args
+        self.predict = predict
+        self.stop = stop
+        self.worker = LatestOnlyExecutor(executor=executor)
+        self.model = self.random.choice(args.models)
+        self.material = self.random.choice(args.materials)
+        self.state = {"shape_id": self.random.choice([0, 1, 2]), "amplitude": 100, "phase": 0, "duty": 40,
+                      "duty2": 30, "frequency": 100, "temperature": 25}
+        self.requests = []  # (submitted, completed or None, status, arguments, (P, H) when done)
+        self.settled = []   # (action, latency) from the last rerun of an action to its shown result
+
+    def prediction_args(self):
+        """The arguments of app.predict for the current page state, as built by app.main."""
+        state, shape_id = self.state, self.state["shape_id"]
+        return (self.model, self.material, RESOLUTION[self.model], shape_id, state["amplitude"], state["phase"],
+                state["duty"] / 100 if shape_id in (1, 2) else None,
+                state["duty2"] / 100 if shape_id == 2 else None,
+                state["frequency"], state["temperature"], None, False)
+
+    def rerun(self):
+        """Submit the prediction of the current state and wait up to the patience of the page."""
+        args = self.prediction_args()
+        submitted = monotonic()
+        future = self.worker.submit(args, self.predict, *args)
+        record = [submitted, None, "pending", args, None]
+        self.requests.append(record)
+
+        def done(future):
+            record[1] = monotonic()
+            if future.cancelled() or isinstance(future.exception(), CancelledError):
+                record[2] = "dropped"
+            elif future.exception() is not None:
+                record[2] = "error"
+            else:
+                _, _, H, P = future.result()
+                record[4] = (P, H)
+                record[2] = "done"
+
+        future.add_done_callback(done)
+        try:
+            future.result(timeout=self.args.patience)
+        except (TimeoutError, CancelledError):
+            pass
+        return future, record
+
+    def action(self):
+        """Perform one user action and return its name with the future of its last rerun."""
+        kind = self.random.choices(["drag", "step", "material", "model", "shape"],
+                                   [1.0, self.args.step_share, self.args.material_share,
+                                    self.args.model_share, self.args.shape_share])[0]
+        if kind == "material":
+            self.material = self.random.choice([m for m in self.args.materials if m != self.material]
+                                               or self.args.materials)
+        elif kind == "model":
+            self.model = self.random.choice([m for m in self.args.models if m != self.model] or self.args.models)
+        elif kind == "shape":
+            self.state["shape_id"] = self.random.choice([s for s in (0, 1, 2) if s != self.state["shape_id"]])
+        elif kind == "step":
+            name = self.random.choice(["frequency", "temperature"])
+            self.state[name] = self.random.randint(*RANGES[name])
+        else:
+            name = self.random.choice(SLIDERS[self.state["shape_id"]])
+            low, high = RANGES[name]
+            target = self.random.randint(low, high)
+            steps = max(1, min(abs(target - self.state[name]), self.args.drag_steps))
+            # The slider reports every step of the drag as one rerun
+            for value in np.linspace(self.state[name], target, steps + 1)[1:-1]:
+                self.state[name] = int(round(value))
+                self.rerun()
+                sleep(1 / self.args.drag_rate)
+            self.state[name] = target
+            if self.state["shape_id"] == 2:
+                self.state["duty2"] = min(self.state["duty2"], 100 - self.state["duty"])
+        return kind, self.rerun()
+
+    def run(self):
+        """Alternate think times and actions until the test ends."""
+        while not self.stop.is_set():
+            kind, (future, record) = self.action()
+            # The page shows the settled state once its prediction completes
+            while not future.done() and not self.stop.is_set():
+                sleep(0.01)
+            if future.done() and record[2] == "done":
+                self.settled.append((kind, record[1] - record[0]))
+            self.stop.wait(self.random.expovariate(1 / self.args.think))
+
+
+def percentiles(values):
+    """Latency percentiles in seconds."""
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {"count": int(values.size), "p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)), "p99": float(np.percentile(values, 99)),
+            "max": float(values.max())}
+
+
+def verify(requests, tolerance):
+    """
+    Check the served predictions against sequential, unmemoized predictions of the same page states.
+
+    Args:
+        requests (list): The request records of all sessions.
+        tolerance (float): The relative error of P, and of H to its peak, counted as a mismatch.
+    """
+    reference = {}
+    checked = mismatches = 0
+    p_error = h_error = 0.0
+    for record in requests:
+        if record[2] != "done":
+            continue
+        key = record[3]
+        if key not in reference:
+            _, _, H, P = app.predict.__wrapped__(*key)
+            reference[key] = (P, H)
+        (P, H), (P_ref, H_ref) = record[4], reference[key]
+        checked += 1
+        if P_ref is None or P is None:
+            mismatches += P is not P_ref
+            continue
+        p = float(abs(P - P_ref) / abs(P_ref))
+        h = float(np.max(np.abs(np.asarray(H) - H_ref)) / np.max(np.abs(H_ref)))
+        p_error, h_error = max(p_error, p), max(h_error, h)
+        mismatches += p > tolerance or h > tolerance
+    return {"checked": checked, "states": len(reference), "mismatches": mismatches,
+            "max_p_error": p_error, "max_h_error": h_error}
+
+
+def run(args):
+    """
+    Run the sessions and sample the memory and throughput over time.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+    """
+    ThreadTopology.from_env().apply()
+    # Outside a Streamlit runtime st.cache_resource loads a new model on every call, while a worker
+    # shares one model per material between all sessions; share them here the same way
+    app.get_model = lru_cache(maxsize=None)(app.get_model.__wrapped__)
+    executor = app.get_executor.__wrapped__()
+    predict = app.predict.__wrapped__ if args.no_cache else app.predict
+    stop = threading.Event()
+    sessions = [Session(i, args, predict, stop, executor) for i in range(args.sessions)]
+
+    # Load the models once, as the first sessions of a worker do
+    for model in args.models:
+        for material in args.materials if args.preload else []:
+            app.get_model(model, material)
+
+    start = monotonic()
+    threads, timers = [], []
+    for i, session in enumerate(sessions):
+        thread = threading.Thread(target=session.run, name=f"session-{i}", daemon=True)
+        threads.append(thread)
+        # Sessions join evenly over the ramp-up
+        timers.append(threading.Timer(args.ramp * i / max(args.sessions, 1), thread.start))
+        timers[-1].start()
+
+    timeline = []
+    previous = 0
+    print(f"{'time':>6s} {'sessions':>8s} {'threads':>7s} {'rss MB':>8s} {'done/s':>7s} {'p50 ms':>7s} {'p99 ms':>7s}")
+    while monotonic() - start < args.duration:
+        sleep(args.sample)
+        now = monotonic() - start
+        completed = [r for s in sessions for r in s.requests if r[2] == "done"]
+        window = [r[1] - r[0] for r in completed if r[1] - start > now - args.sample]
+        sample = {"time": now, "sessions": sum(thread.is_alive() for thread in threads),
+                  "threads": threading.active_count(), "rss": rss(),
+                  "throughput": (len(completed) - previous) / args.sample,
+                  "p50": float(np.percentile(window, 50)) if window else None,
+                  "p99": float(np.percentile(window, 99)) if window else None}
+        previous = len(completed)
+        timeline.append(sample)
+        p50, p99 = (f"{sample[k]*1e3:.0f}" if sample[k] is not None else "-" for k in ("p50", "p99"))
+        print(f"{now:6.1f} {sample['sessions']:8d} {sample['threads']:7d} {sample['rss']/1e6:8.0f} {sample['throughput']:7.1f} "
+              f"{p50:>7s} {p99:>7s}")
+    stop.set()
+    for timer in timers:
+        timer.cancel()
+    for thread in threads:
+        if thread.ident is not None:  # sessions that never started are skipped
+            thread.join()
+    elapsed = monotonic() - start
+
+    requests = [r for s in sessions for r in s.requests]
+    statuses = {status: sum(r[2] == status for r in requests) for status in ("done", "dropped", "error")}
+    results = {
+        "requests": statuses,
+        "offered_per_s": len(requests) / elapsed,
+        "throughput_per_s": statuses["done"] / elapsed,
+        "request_latency": percentiles([r[1] - r[0] for r in requests if r[2] == "done"]),
+        "settle_latency": percentiles([latency for s in sessions for _, latency in s.settled]),
+        "settle_latency_by_action": {kind: percentiles([latency for s in sessions for k, latency in s.settled
+                                                        if k == kind])
+                                     for kind in ("drag", "step", "material", "model", "shape")},
+        "peak_rss": max(sample["rss"] for sample in timeline) if timeline else rss(),
+        "timeline": timeline,
+    }
+    if args.verify:
+        results["correctness"] = verify(requests, args.tolerance)
+    print(f"\n{args.sessions} sessions for {elapsed:.0f} s: {len(requests)} reruns ({results['offered_per_s']:.1f}/s), "
+          f"{statuses['done']} predicted ({results['throughput_per_s']:.1f}/s), {statuses['dropped']} dropped, "
+          f"{statuses['error']} failed, peak RSS {results['peak_rss']/1e6:.0f} MB")
+    for name in ("request_latency", "settle_latency"):
+        print_percentiles(name.replace("_", " "), results[name])
+    for kind, latency in results["settle_latency_by_action"].items():
+        print_percentiles(f"  settle after {kind}", latency)
+    if args.verify:
+        print("{:24s} {checked} predictions of {states} states, {mismatches} mismatches, "
+              "max relative error P {max_p_error:.1e}, H {max_h_error:.1e}".format("correctness",
+                                                                               **results["correctness"]))
+    return results
+
+
+def print_percentiles(name, latency):
+    """Print one row of latency percentiles."""
+    if latency:
+        print("{:24s} n={count:<6d} p50 {:7.0f} ms  p90 {:7.0f} ms  p99 {:7.0f} ms  max {:7.0f} ms".format(
+            name, *(latency[k] * 1e3 for k in ("p50", "p90", "p99", "max")), **latency))
+
+
+def main():
+    """
+    Command line entry point.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent sessions")
+    parser.add_argument("--duration", type=float, default=60, help="test duration in s")
+    parser.add_argument("--ramp", type=float, default=5, help="ramp-up of the sessions in s")
+    parser.add_argument("--models", nargs="+", default=TEAMS, choices=TEAMS)
+    parser.add_argument("--materials", nargs="+", default=["N87", "3C90", "3C94", "N49"], choices=MATERIALS)
+    parser.add_argument("--think", type=float, default=2.0, help="mean think time between actions in s")
+    parser.add_argument("--drag-rate", type=float, default=15, help="reruns per s while a slider is dragged")
+    parser.add_argument("--drag-steps", type=int, default=12, help="maximum reruns per drag")
+    parser.add_argument("--step-share", type=float, default=0.3, help="frequency of typed inputs per drag")
+    parser.add_argument("--material-share", type=float, default=0.1, help="frequency of material changes per drag")
+    parser.add_argument("--model-share", type=float, default=0.05, help="frequency of model changes per drag")
+    parser.add_argument("--shape-share", type=float, default=0.1, help="frequency of shape changes per drag")
+    parser.add_argument("--patience", type=float, default=0.3, help="wait of a rerun for its prediction in s")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the memoization of the predictions")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="load the models on first use, inside the measured sessions")
+    parser.add_argument("--sample", type=float, default=2.0, help="timeline interval in s")
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="skip the check against sequential predictions after the test")
+    parser.add_argument("--tolerance", type=float, default=1e-6,
+                        help="relative error of a served prediction counted as a mismatch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON file to store the results in")
+    args = parser.parse_args()
+
+    # The app runs outside of a streamlit server, its caches warn about the missing runtime
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    results = {"environment": environment_info(), "settings": vars(args), **run(args)}
+    if args.out:
+        save_results(args.out, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,221 @@ Source: https://github.com/moetomg/magnet-engine
 import streamlit as st
 import streamlit_vertical_slider as svs
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import BytesIO
 from os import getcwd
 from os.path import join
+from threading import Lock, current_thread
+from time import sleep
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from background import LatestOnlyExecutor
+from teams.preprocessing import resample_periodic
+from numpy import array, linspace, genfromtxt, append, sin, pi, empty, full, isnan
 from pandas import DataFrame
 from footer import footer
+from runtime import ThreadTopology
 from utils import load_model, draw_donut, draw_line, generateTriSequence, generateTrapSequence
 
+@st.cache_resource(show_spinner=False)
+def apply_topology():
+    """
+    Apply the thread topology of this worker from the MAGNET_* environment variables once per process.
+
+    The script reruns on every interaction, while the topology is process-wide and torch only accepts
+    the inter-op setting before the first inter-op work.
+    """
+    return ThreadTopology.from_env().apply()
+
+@st.cache_resource(show_spinner="Loading the model...")
+def get_model(model, material):
+    """
+    Load the core loss model once and share it between all sessions and reruns.
+
+    The models are not reentrant (the Sydney network keeps its recurrent state on the module), so
+    every call must hold the returned lock.
+
+    Args:
+        model (string): The name of the model.
+        material (string): The name of the material.
+
+    Return:
+        The model and the lock serializing its calls.
+    """
+    return load_model(model, material), Lock()
+
+@st.cache_resource(show_spinner=False)
+def get_executor():
+    """
+    Create the thread pool running the predictions of all sessions once per process.
+
+    Streamlit does not notify the script when a session ends, so a worker thread per session
+    would outlive it; the pool is bounded and its threads are reused.
+    """
+    return ThreadPoolExecutor(thread_name_prefix="magnet-predict")
+
+@st.cache_data(show_spinner=False)
+def read_icon(icon_path):
+    """
+    Read the SVG code of an icon once.
+
+    Args:
+        icon_path (string): The path of the SVG file.
+    """
+    with open(icon_path, "r") as file:
+        return file.read()
+
+@st.cache_data(show_spinner=False, max_entries=1024)
+def get_donut(input_response, input_text, input_color, range):
+    """
+    Draw a donut plot once per displayed value (see utils.draw_donut).
+
+    """
+    return draw_donut(input_response, input_text, input_color, range)
+
+# Waveforms per model call in batch predictions, at most one dataloader batch of the Sydney model,
+# which returns H of its last batch only
+BATCH_CHUNK = 128
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_waveforms(upload, resolution, conditions=False):
+    """
+    Read a CSV file of waveforms, one cycle of B in T per row, resampled to the model resolution.
+
+    Args:
+        upload (bytes): The content of the CSV file.
+        resolution (int): The number of steps of the model.
+        conditions (bool): The last two columns of each row hold f in Hz and T in °C.
+
+    Return:
+        B of shape (N, resolution) in T, and f and T of shape (N,) or None.
+    """
+    data = genfromtxt(BytesIO(upload), delimiter=',', ndmin=2)
+    # Skip header and incomplete rows
+    data = data[~isnan(data).any(axis=1)]
+    if conditions:
+        data, frequency, temperature = data[:, :-2], data[:, -2], data[:, -1]
+    else:
+        frequency = temperature = None
+    if len(data) == 0 or data.shape[1] < 2:
+        raise ValueError("no complete waveform found")
+    return resample_periodic(data, resolution), frequency, temperature
+
+def predict_batch(model, material, B, frequency, temperature, progress=None, chunk=BATCH_CHUNK):
+    """
+    Predict the field strength and core loss density of many waveforms in chunks.
+
+    Args:
+        model (string): The name of the model.
+        material (string): The name of the material.
+        B (np.array): The flux density of shape (N, L) in T.
+        frequency (np.array): The frequency of shape (N,) in Hz.
+        temperature (np.array): The temperature of shape (N,) in °C.
+        progress (streamlit element): The progress bar to update after every chunk.
+        chunk (int): The number of waveforms per model call.
+    """
+    mdl, lock = get_model(model, material)
+    P = empty(len(B))
+    H = empty(B.shape)
+    for start in range(0, len(B), chunk):
+        stop = min(start + chunk, len(B))
+        # Released between chunks, so the predictions of other sessions are not blocked by the whole batch
+        with lock:
+            P[start:stop], H[start:stop] = mdl(B[start:stop], frequency[start:stop], temperature[start:stop])
+        if progress is not None:
+            progress.progress(stop / len(B), text=f"Predicted {stop} of {len(B)} waveforms")
+    return P, H
+
+def generate_waveform(resolution, shape_id, amplitude, phase, duty, duty2, upload, conditions=False):
+    """
+    Generate one cycle of the flux density excitation in mT.
+
+    Args:
+        resolution (int): The number of steps of the model.
+        shape_id (int): The waveform shape (0-sin 1-tri 2-trap 3-user).
+        amplitude (float): The amplitude in mT.
+        phase (float): The initial phase in degrees.
+        duty (float): The (rising) duty cycle.
+        duty2 (float): The falling duty cycle.
+        upload (bytes): The content of the user CSV file, its first row is used.
+        conditions (bool): The rows of the CSV file end with f and T.
+    """
+    t = linspace(0, 0, resolution)
+    B = linspace(0, 0, resolution)
+    if shape_id == 0:
+        t = linspace(0, 1, resolution)
+        B = amplitude * sin((360 * t + phase) * pi / 180)
+    elif shape_id == 1:
+        t = linspace(0, 1, resolution)
+        B = array(generateTriSequence(t, amplitude, phase, duty))
+    elif shape_id == 2:
+        t = linspace(0, 1, resolution)
+        B = array(generateTrapSequence(t, amplitude, phase, duty, duty2))
+    elif upload is not None:
+        t = linspace(0, 1, resolution)
+        B = read_waveforms(upload, resolution, conditions)[0][0] * 1000  # convert to mT
+    return t, B
+
+@st.cache_data(show_spinner=False, max_entries=4096)
+def predict(model, material, resolution, shape_id, amplitude, phase, duty, duty2, frequency, temperature, upload=None,
+            conditions=False):
+    """
+    Predict the field strength and core loss density of one operating point.
+
+    Memoized per (model, material, waveform parameters, f, T), so revisiting a previous slider state
+    makes no model call. Parameters unused by the selected shape are passed as None.
+
+    Args:
+        model (string): The name of the model.
+        material (string): The name of the material.
+        resolution (int): The number of steps of the model.
+        shape_id, amplitude, phase, duty, duty2, upload, conditions: The waveform parameters (see generate_waveform).
+        frequency (float): The frequency in kHz.
+        temperature (float): The temperature in °C.
+    """
+    t, B = generate_waveform(resolution, shape_id, amplitude, phase, duty, duty2, upload, conditions)
+    if sum(B) == 0:
+        return t, B, linspace(0, 0, resolution), None
+    mdl, lock = get_model(model, material)
+    with lock:
+        P, H = mdl(B / 1000, frequency * 1000, temperature)  # convert to B in [T], f in [Hz]
+    return t, B, H.squeeze(), P
+
+def get_prediction(*args, patience=0.3):
+    """
+    Run the prediction in the shared thread pool, latest-only per session.
+
+    Waits up to `patience` seconds for the result (memoized states return at once). Slower
+    predictions return the last completed result together with the pending future, so the page
+    stays responsive while the sliders move.
+
+    Args:
+        args: The arguments of predict.
+        patience (float): The time in seconds to wait for the result before falling back.
+
+    Return:
+        The prediction (t, B, H, P) and the pending future, or None when the prediction is current.
+    """
+    if 'worker' not in st.session_state:
+        st.session_state['worker'] = LatestOnlyExecutor(executor=get_executor())
+    worker = st.session_state['worker']
+    ctx = get_script_run_ctx()
+
+    def job(*args):
+        # Run within the session context, as the caches and spinners expect (the pool threads are
+        # shared, every job attaches the context of its own session)
+        add_script_run_ctx(current_thread(), ctx)
+        return predict(*args)
+
+    future = worker.submit(args, job, *args)
+    try:
+        return future.result(timeout=patience), None
+    except TimeoutError:
+        if worker.last is None:
+            # Nothing to show yet
+            with st.spinner("Predicting..."):
+                return future.result(), None
+        return worker.last[1], future
+
 def main():
     """
     GUI main page setting.
@@ -74,8 +283,8 @@ def main():
         model = st.selectbox('Select a model', models, index=len(models)-1)
         material = st.selectbox('Target material', materials, index=len(materials)-1)
         
-        # Initialize and load the model 
-        mdl = load_model(model,material)
+        # Load the model once, shared between sessions
+        get_model(model, material)
 
         # White space acts as separator
         st.sidebar.markdown(
@@ -172,9 +381,7 @@ def main():
         _, col1_1, col1_2 = st.columns([0.15, 1, 1]) 
         for i, (label, icon_filename) in enumerate(shapes):
             with col1_1 if (i==0 or i==2) else col1_2:
-                icon_path = join(icon_folder, icon_filename)
-                with open(icon_path, "r") as file:
-                    svg_code = file.read()    
+                svg_code = read_icon(join(icon_folder, icon_filename))
                 if st.button(label):
                     st.session_state['shape_id'] = i
                 st.write(f'<div style="text-align: left; margin-left:calc(40px - 1.5vw);"><span style="display: inline-block; width: calc(4vw + 25px); height: calc(4vh + 60px); fill: #F5F5F5;">{svg_code}</span></div>', unsafe_allow_html=True)
@@ -272,7 +479,14 @@ def main():
                 
         # Allow user to upload a customized waveform
         if st.session_state['shape_id'] == 3: 
-            uploaded_file = st.file_uploader("Resolution >= :red["+str(resolution_params[model])+" steps]", type=['csv'], help="Load user-defined flux excitation and :red[only read data in the 1st row].")
+            uploaded_file = st.file_uploader("One cycle per row, resampled to :red["+str(resolution_params[model])+" steps]", type=['csv'], help="Load user-defined flux excitations in T, one cycle per row at any resolution. The plots show :red[the 1st row], all rows can be predicted as a batch below.")
+            conditions = st.checkbox("Rows end with f [Hz], T [°C]", help="Use the last two columns of each row as its frequency and temperature instead of the operating conditions below.")
+            if uploaded_file is not None:
+                try:
+                    waveforms = read_waveforms(uploaded_file.getvalue(), resolution_params[model], conditions)
+                except ValueError as error:
+                    st.error(f"Cannot read the waveforms: {error}")
+                    uploaded_file = None
 
     # Define the first element in the second row 
     with col4:
@@ -298,46 +512,38 @@ def main():
         
         with col4_2:
             # Add donut plot for frequency 
-            donut_chart_F = draw_donut(Frequency, 'Frequency', 'blue', [10, 450])
+            donut_chart_F = get_donut(Frequency, 'Frequency', 'blue', [10, 450])
             st.altair_chart(donut_chart_F, use_container_width=True)
             
             # Add donut plot for temperature
-            donut_chart_T = draw_donut(Temperature, 'Temperature', 'red', [25, 90])
+            donut_chart_T = get_donut(Temperature, 'Temperature', 'red', [25, 90])
             st.altair_chart(donut_chart_T, use_container_width=True)
 
     # Define the second element in the first row 
     with col2:
-        # Import numpy package
-        from numpy import array, linspace, genfromtxt, arange, append, sin, pi
-        
         # Display message
         st.write("""<span style='font-size: calc(0.6vw + 0.6vh + 10px); text-decoration: none; font-weight: bold;text-align: left;'> Time-Domain Response [B-H]</span>""", unsafe_allow_html=True)
 
-        # Data loading 
-        t = linspace(0, 0, resolution_params[model])
-        B = linspace(0, 0, resolution_params[model])
-        if st.session_state['shape_id'] == 0: 
-            t = linspace(0, 1, resolution_params[model])
-            B = st.session_state['amplitude'] * sin((360 * t+st.session_state['phase']) * pi / 180)
-        elif st.session_state['shape_id'] == 1:
-            t = linspace(0, 1, resolution_params[model])
-            B = array(generateTriSequence(t, st.session_state['amplitude'], st.session_state['phase'], st.session_state['duty']))
-        elif st.session_state['shape_id'] == 2:  
-            t = linspace(0, 1, resolution_params[model])  
-            B = array(generateTrapSequence(t, st.session_state['amplitude'], st.session_state['phase'], st.session_state['duty'], st.session_state['duty2']))
-        else: 
-            if uploaded_file is not None: 
-                t = linspace(0, 1, resolution_params[model])  
-                first_row = genfromtxt(uploaded_file, delimiter=',', max_rows=1)
-                index = [int(x) for x in arange(0, len(first_row) - 1, (len(first_row) - 1)/ resolution_params[model])]
-                B = array(first_row[index].tolist()) * 1000  # convert to mT
-       
-        # Predict field strength and core loss density 
-        if sum(B) == 0:
-            H  = linspace(0, 0, resolution_params[model])
+        # Waveform parameters of the selected shape, the others are left out of the cache key
+        shape_id = st.session_state['shape_id']
+        amplitude = st.session_state['amplitude'] if shape_id != 3 else None
+        phase = st.session_state['phase'] if shape_id != 3 else None
+        duty = st.session_state['duty'] if shape_id in (1, 2) else None
+        duty2 = st.session_state['duty2'] if shape_id == 2 else None
+        upload = uploaded_file.getvalue() if shape_id == 3 and uploaded_file is not None else None
+        conditions = conditions if upload is not None else False
+        if conditions:
+            # The plotted 1st row runs at its own operating point, like in the batch prediction
+            frequency, temperature = float(waveforms[1][0]) / 1000, float(waveforms[2][0])  # convert to f in [kHz]
         else:
-            P ,H = mdl(B / 1000, Frequency * 1000, Temperature) # convert to B in [T], f in [Hz]
-            H = H.squeeze()
+            frequency, temperature = Frequency, Temperature
+
+        # Predict field strength and core loss density in the background (memoized)
+        (t, B, H, P), pending = get_prediction(model, material, resolution_params[model], shape_id, amplitude, phase,
+                                               duty, duty2, frequency, temperature, upload, conditions)
+        status = st.empty()
+        if pending is not None:
+            status.caption("⏳ Updating, showing the last result...")
 
         # Add repeated first point to close curve
         t = append(t, t[0])
@@ -426,8 +632,52 @@ def main():
                     mime='text/csv',
                 )
 
+    # Batch prediction of all rows of the uploaded file
+    if upload is not None:
+        B_batch, F_batch, T_batch = waveforms
+        if F_batch is None:
+            F_batch = full(len(B_batch), Frequency * 1000.0)  # convert to f in [Hz]
+            T_batch = full(len(B_batch), float(Temperature))
+        batch_key = (model, material, upload, conditions, None if conditions else (Frequency, Temperature))
+
+        st.markdown("<div style='height:0.5vh;'></div>", unsafe_allow_html=True)
+        with st.expander(f"Batch prediction [{len(B_batch)} waveforms]", expanded=True):
+            if st.button("Predict all rows ▶"):
+                progress = st.progress(0.0, text=f"Predicted 0 of {len(B_batch)} waveforms")
+                P_batch, H_batch = predict_batch(model, material, B_batch, F_batch, T_batch, progress)
+                results = DataFrame(H_batch, columns=[f'H{i} [A/m]' for i in range(H_batch.shape[1])])
+                results.insert(0, 'f [Hz]', F_batch)
+                results.insert(1, 'T [°C]', T_batch)
+                results.insert(2, 'Pv [W/m3]', P_batch)
+                st.session_state['batch'] = (batch_key, results)
+
+            # Offer the results of the current file and settings
+            if 'batch' in st.session_state and st.session_state['batch'][0] == batch_key:
+                results = st.session_state['batch'][1]
+                parquet = BytesIO()
+                results.to_parquet(parquet)
+                _, col7_1, col7_2 = st.columns([2.3, 1, 1])
+                with col7_1:
+                    st.download_button("Download CSV 📂", results.to_csv(index_label='waveform').encode('utf-8'),
+                                       file_name='magnet-engine_batch.csv', mime='text/csv',
+                                       use_container_width=True)
+                with col7_2:
+                    st.download_button("Download Parquet 📂", parquet.getvalue(),
+                                       file_name='magnet-engine_batch.parquet',
+                                       mime='application/vnd.apache.parquet', use_container_width=True)
+                st.dataframe(results.iloc[:, :3], use_container_width=True, height=200)
+
+    # Rerun once the pending prediction arrives. Updating the status hands control back to streamlit,
+    # which stops this run as soon as a newer widget value supersedes the request.
+    if pending is not None:
+        while not pending.done():
+            sleep(0.1)
+            status.caption("⏳ Updating, showing the last result...")
+        st.rerun()
+
 # Main program
 if __name__ == "__main__":
+    apply_topology()
     main()
     footer()
 
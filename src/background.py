@@ -0,0 +1,97 @@
+"""
+File contains the background execution of the GUI predictions.
+
+Dragging a slider produces a burst of reruns, one per intermediate value. Each session owns one
+LatestOnlyExecutor: predictions run in a thread pool shared by all sessions of the process, rapid
+successive requests of a session are debounced, and requests superseded by a newer one of the same
+session are dropped, so only the latest slider state is computed while the page keeps showing the
+last completed result. Sessions end without notice, so they hold no thread of their own.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import threading
+
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from time import monotonic, sleep
+
+
+class LatestOnlyExecutor:
+    """
+    Run the latest submitted prediction in a background thread.
+
+    A request is debounced when it follows the previous one within `delay` seconds: it only starts
+    once no newer request arrived for `delay` seconds. Requests that have not started when a newer
+    one is submitted are cancelled. A running model call cannot be interrupted; its result is
+    discarded if it was superseded in the meantime.
+
+    Parameters:
+    - delay: debounce interval in seconds
+    - executor: the thread pool running the requests, shared between sessions; by default the
+      executor owns one worker thread, which shutdown stops
+    """
+
+    def __init__(self, delay=0.2, executor=None):
+        self.delay = delay
+        self.last = None  # (key, result) of the last completed request
+        self._owned = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="magnet-predict")
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._submitted = -float("inf")
+        self._key = None
+        self._future = None
+
+    def submit(self, key, func, *args):
+        """
+        Request `func(*args)`, superseding all earlier requests.
+
+        Args:
+            key (tuple): The identity of the request, resubmitting the current key returns its future.
+            func (function): The prediction function.
+            args: The arguments of the prediction function.
+        """
+        with self._lock:
+            if self._future is not None and self._key == key and not self._future.cancelled():
+                return self._future
+            now = monotonic()
+            debounce = now - self._submitted < self.delay
+            self._submitted = now
+            self._generation += 1
+            if self._future is not None:
+                self._future.cancel()
+            self._key = key
+            self._future = self._executor.submit(self._run, self._generation, debounce, key, func, args)
+            return self._future
+
+    def _superseded(self, generation):
+        """Check whether a newer request was submitted."""
+        return generation != self._generation
+
+    def _run(self, generation, debounce, key, func, args):
+        """Wait for the inputs to settle, then run the request unless it was superseded."""
+        if debounce:
+            deadline = monotonic() + self.delay
+            while monotonic() < deadline:
+                if self._superseded(generation):
+                    raise CancelledError()
+                sleep(0.01)
+        if self._superseded(generation):
+            raise CancelledError()
+
+        result = func(*args)
+        with self._lock:
+            if self._superseded(generation):
+                raise CancelledError()
+            self.last = (key, result)
+        return result
+
+    def shutdown(self):
+        """Drop pending requests and stop the worker thread, unless the thread pool is shared."""
+        with self._lock:
+            self._generation += 1
+            if self._future is not None:
+                self._future.cancel()
+        if self._owned:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,348 @@
+"""
+File contains the inverse design of excitations with the core loss models.
+
+Design questions such as "which amplitude meets a loss budget at this f and T" or "which duty minimizes
+the loss" are answered by bracketed searches over one waveform parameter. Many searches run in
+parallel: every iteration places a grid of candidates inside the bracket of each active search and
+evaluates all of them in one batched model call, so that the bracket shrinks by the factor points+1
+per call instead of 2 for a scalar bisection.
+
+The model is any callable model(B, f, T) returning the loss density first, e.g. SydneyModel,
+PaderbornModel or runtime.ThreadedModel. The waveform is a vectorized callable waveform(x, index)
+mapping the parameter candidates x of shape (S, K) of the searches index (S,), with K candidates
+each, to flux density waveforms of shape (S, K, L). The search index selects the fixed parameters
+of each search, e.g. its shape or phase.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import numpy as np
+
+from scipy.stats import kendalltau
+
+
+def evaluate(model, waveform, x, index, frequency, temperature):
+    """
+    Evaluate the loss density of all candidates in one model call.
+
+    Args:
+        model (object): The core loss model.
+        waveform (function): The vectorized waveform generator.
+        x (np.array): The parameter candidates of shape (S, K).
+        index (np.array): The searches of the candidates, shape (S,).
+        frequency (np.array): The frequency of all searches in Hz.
+        temperature (np.array): The temperature of all searches in °C.
+
+    Return:
+        The loss densities of shape (S, K) in W/m³.
+    """
+    searches, candidates = x.shape
+    B = np.asarray(waveform(x, index))
+    P = model(B.reshape(searches * candidates, -1), np.repeat(frequency[index], candidates),
+              np.repeat(temperature[index], candidates))[0]
+    return np.asarray(P, dtype=float).reshape(searches, candidates)
+
+
+def _grid(lower, upper, points, log_scale):
+    """Place the bracket ends and `points` equidistant candidates between them, shape (S, points+2)."""
+    steps = np.linspace(0, 1, points + 2)
+    if log_scale:
+        return np.exp(np.log(lower)[:, None] + (np.log(upper) - np.log(lower))[:, None] * steps)
+    return lower[:, None] + (upper - lower)[:, None] * steps
+
+
+def _prepare(lower, upper, frequency, temperature, *others):
+    """Broadcast the search inputs to one entry per search."""
+    arrays = np.broadcast_arrays(*(np.atleast_1d(np.asarray(a, dtype=float))
+                                   for a in (lower, upper, frequency, temperature, *others)))
+    return [a.copy() for a in arrays]
+
+
+def solve_target(model, waveform, target, lower, upper, frequency, temperature, points=8, tol=1e-4,
+                 max_iter=50, log_scale=False):
+    """
+    Find the parameter at which the loss density meets a target, for many searches in parallel.
+
+    The loss density must be monotonic in the parameter within [lower, upper]. Searches whose target is
+    not bracketed by the loss densities at the bounds are reported and return NaN. The final parameter
+    is interpolated linearly between the last bracket ends.
+
+    Args:
+        model (object): The core loss model.
+        waveform (function): The vectorized waveform generator, see the file docstring.
+        target (np.array): The target loss density of each search in W/m³.
+        lower (np.array): The lower parameter bound of each search.
+        upper (np.array): The upper parameter bound of each search.
+        frequency (np.array): The frequency of each search in Hz.
+        temperature (np.array): The temperature of each search in °C.
+        points (int): The candidates evaluated per search and iteration.
+        tol (float): The final bracket width relative to the initial one.
+        max_iter (int): The maximum number of iterations.
+        log_scale (bool): Place the candidates equidistant in log(parameter), e.g. for amplitudes.
+
+    Return:
+        A dictionary with the parameter "x" and the loss density "p" of each search, the "bracketed"
+        searches, and the number of "iterations" and of evaluated "waveforms".
+    """
+    lower, upper, frequency, temperature, target = _prepare(lower, upper, frequency, temperature, target)
+    ends = evaluate(model, waveform, np.column_stack((lower, upper)), np.arange(len(lower)), frequency,
+                    temperature)
+    waveforms = ends.size
+    # Orient every search so that the residual increases with the parameter
+    direction = np.where(ends[:, 1] >= ends[:, 0], 1.0, -1.0)
+    f_lower, f_upper = (ends[:, 0] - target) * direction, (ends[:, 1] - target) * direction
+    bracketed = (f_lower <= 0) & (f_upper >= 0)
+
+    width = upper - lower
+    active = bracketed & (f_lower < 0) & (f_upper > 0)
+    iterations = 0
+    while np.any(active) and iterations < max_iter:
+        iterations += 1
+        index = np.flatnonzero(active)
+        nodes = _grid(lower[index], upper[index], points, log_scale)
+        residual = np.empty_like(nodes)
+        residual[:, 0], residual[:, -1] = f_lower[index], f_upper[index]
+        residual[:, 1:-1] = (evaluate(model, waveform, nodes[:, 1:-1], index, frequency, temperature)
+                             - target[index, None]) * direction[index, None]
+        waveforms += nodes[:, 1:-1].size
+
+        # The sub-interval ending at the first non-negative residual holds the target
+        rows = np.arange(len(nodes))
+        first = np.clip(np.argmax(residual >= 0, axis=1), 1, points + 1)
+        lower[index], upper[index] = nodes[rows, first - 1], nodes[rows, first]
+        f_lower[index], f_upper[index] = residual[rows, first - 1], residual[rows, first]
+        active[index] = (upper[index] - lower[index] > tol * width[index]) & (f_upper[index] > 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(f_upper > f_lower, -f_lower / (f_upper - f_lower), 0.0)
+    x = np.where(bracketed, lower + (upper - lower) * np.clip(share, 0, 1), np.nan)
+    p = np.full_like(x, np.nan)
+    if np.any(bracketed):
+        p[bracketed] = evaluate(model, waveform, x[bracketed, None], np.flatnonzero(bracketed), frequency,
+                                temperature)[:, 0]
+        waveforms += int(bracketed.sum())
+    return {"x": x, "p": p, "bracketed": bracketed, "iterations": iterations, "waveforms": waveforms}
+
+
+def minimize_loss(model, waveform, lower, upper, frequency, temperature, points=8, tol=1e-4, max_iter=50,
+                  log_scale=False):
+    """
+    Find the parameter with the minimum loss density within bounds, for many searches in parallel.
+
+    Every iteration evaluates a grid over the bracket and narrows it to the neighbours of the best
+    candidate. The loss density must be unimodal in the parameter within [lower, upper], the minimum
+    may lie on a bound.
+
+    Args:
+        model (object): The core loss model.
+        waveform (function): The vectorized waveform generator, see the file docstring.
+        lower (np.array): The lower parameter bound of each search.
+        upper (np.array): The upper parameter bound of each search.
+        frequency (np.array): The frequency of each search in Hz.
+        temperature (np.array): The temperature of each search in °C.
+        points (int): The candidates evaluated per search and iteration (at least 2).
+        tol (float): The final bracket width relative to the initial one.
+        max_iter (int): The maximum number of iterations.
+        log_scale (bool): Place the candidates equidistant in log(parameter).
+
+    Return:
+        A dictionary with the parameter "x" and the loss density "p" of each search, and the number of
+        "iterations" and of evaluated "waveforms".
+    """
+    lower, upper, frequency, temperature = _prepare(lower, upper, frequency, temperature)
+    points = max(points, 2)
+    nodes = _grid(lower, upper, points, log_scale)
+    rows = np.arange(len(nodes))
+    loss = evaluate(model, waveform, nodes, rows, frequency, temperature)
+    waveforms = loss.size
+    best = np.argmin(loss, axis=1)
+    x, p = nodes[rows, best], loss[rows, best]
+
+    width = upper - lower
+    index = rows  # searches of the current grid
+    iterations = 0
+    while True:
+        # Narrow the brackets to the neighbours of the best candidates, keeping their loss densities
+        left, right = np.maximum(best - 1, 0), np.minimum(best + 1, points + 1)
+        lower[index], upper[index] = nodes[rows, left], nodes[rows, right]
+        ends = np.column_stack((loss[rows, left], loss[rows, right]))
+        active = upper[index] - lower[index] > tol * width[index]
+        if not np.any(active) or iterations == max_iter:
+            break
+        iterations += 1
+        index, ends = index[active], ends[active]
+        nodes = _grid(lower[index], upper[index], points, log_scale)
+        loss = np.empty_like(nodes)
+        loss[:, [0, -1]] = ends
+        loss[:, 1:-1] = evaluate(model, waveform, nodes[:, 1:-1], index, frequency, temperature)
+        waveforms += nodes[:, 1:-1].size
+        rows = np.arange(len(nodes))
+        best = np.argmin(loss, axis=1)
+        improved = loss[rows, best] < p[index]
+        x[index[improved]], p[index[improved]] = nodes[rows, best][improved], loss[rows, best][improved]
+    return {"x": x, "p": p, "iterations": iterations, "waveforms": waveforms}
+
+
+def _loss(models, B, frequency, temperature, material=None):
+    """Evaluate the loss density with one model, or with one model per material."""
+    if material is None:
+        return np.asarray(models(B, frequency, temperature)[0], dtype=float).reshape(-1)
+    P = np.empty(len(B))
+    for name in np.unique(material):
+        rows = material == name
+        P[rows] = np.asarray(models[name](B[rows], frequency[rows], temperature[rows])[0], dtype=float).reshape(-1)
+    return P
+
+
+class SteinmetzEstimator:
+    """
+    Composite-waveform Steinmetz approximation of a core loss model, used as cheap first screening tier.
+
+        log P = c0 + c1 log f + c2 log ΔB + c3 log mean(|L ΔB_k / ΔB|^α) + c4 T + c5 T²
+
+    where ΔB is the peak-to-peak flux density and ΔB_k the change over sample k of the L samples per
+    period. The shape term generalizes the Steinmetz equation to arbitrary waveforms like the iGSE.
+    The coefficients are fitted by least squares to the model outputs, α by a grid search.
+
+    Parameters:
+    - alphas: candidate exponents of the shape term
+    """
+
+    def __init__(self, alphas=(1.0, 1.2, 1.4, 1.6, 1.8, 2.0)):
+        self.alphas = alphas
+        self.alpha = None
+        self.coefficients = None
+
+    @staticmethod
+    def features(B, frequency, temperature, alpha):
+        """Build the regression features of shape (N, 6)."""
+        B = np.atleast_2d(B)
+        peak2peak = np.ptp(B, axis=1)
+        change = np.abs(np.diff(B, axis=1, append=B[:, :1])) * B.shape[1] / peak2peak[:, None]
+        frequency, temperature = np.broadcast_to(frequency, len(B)), np.broadcast_to(temperature, len(B))
+        return np.column_stack((np.ones(len(B)), np.log(frequency), np.log(peak2peak),
+                                np.log(np.mean(change ** alpha, axis=1)), temperature, temperature ** 2))
+
+    def fit(self, B, frequency, temperature, P):
+        """
+        Fit the coefficients to known loss densities, e.g. full model outputs on a calibration sample.
+
+        Args:
+            B (np.array): The flux density in T of shape (N, L), N of at least 6.
+            frequency (np.array): The frequency in Hz.
+            temperature (np.array): The temperature in °C.
+            P (np.array): The loss density in W/m³.
+        """
+        best = None
+        for alpha in self.alphas:
+            X = self.features(B, frequency, temperature, alpha)
+            coefficients, *_ = np.linalg.lstsq(X, np.log(P), rcond=None)
+            residual = np.sum((X @ coefficients - np.log(P)) ** 2)
+            if best is None or residual < best[0]:
+                best = (residual, alpha, coefficients)
+        _, self.alpha, self.coefficients = best
+        return self
+
+    def __call__(self, B, frequency, temperature):
+        """Estimate the loss density, with the call signature of the models (no H estimate)."""
+        return np.exp(self.features(B, frequency, temperature, self.alpha) @ self.coefficients), None
+
+
+def screen(model, B, frequency, temperature, k=10, threshold=None, margin=1.0, estimator=None, material=None,
+           calibration=64, seed=0, max_rounds=3):
+    """
+    Tiered screening of candidate excitations for the lowest loss densities.
+
+    A cheap estimator ranks all candidates, then only the shortlist is evaluated with the full model:
+    the candidates estimated within (1+margin) of the k-th lowest loss, and, with a threshold (loss
+    budget), those estimated below threshold*(1+margin). The margin absorbs the estimation error, the
+    report shows how much of it was needed.
+
+    Args:
+        model (object): The full core loss model, or a dictionary of models per material.
+        B (np.array): The flux density of the candidates in T, shape (N, L).
+        frequency (np.array): The frequency of the candidates in Hz.
+        temperature (np.array): The temperature of the candidates in °C.
+        k (int): The number of best candidates to find, None to screen against the threshold only.
+        threshold (float): The loss budget in W/m³, optional.
+        margin (float): The relative safety margin of the shortlist.
+        estimator (object): The cheap first tier with the call signature of the models (or a dictionary
+            per material), e.g. a faster team model. By default a SteinmetzEstimator is fitted to the full
+            model on a seeded random sample of the candidates.
+        material (np.array): The material of every candidate, if model is a dictionary.
+        calibration (int): The sample size of the estimator fit per material.
+        seed (int): The seed of the calibration sample.
+        max_rounds (int): The maximum number of fits of the default estimator. Every round refits it to all
+            full model outputs so far and evaluates the candidates newly entering the shortlist.
+
+    Return:
+        A dictionary with the "index" of the k best candidates by the full model, the full loss density
+        "p" (NaN where not evaluated), the "estimate" of all candidates, the "shortlist" and the
+        "passed" candidates (full loss within the threshold), and the "report": the number of full model
+        evaluations, the share of swapped pairs in the shortlist, the estimation error, how many of the top k
+        changed, the margin the top k required and the candidates flipping across the threshold.
+    """
+    B = np.atleast_2d(np.asarray(B, dtype=float))
+    n = len(B)
+    frequency = np.broadcast_to(np.asarray(frequency, dtype=float), (n,))
+    temperature = np.broadcast_to(np.asarray(temperature, dtype=float), (n,))
+    material = None if material is None else np.broadcast_to(np.asarray(material), (n,))
+    P = np.full(n, np.nan)
+
+    # 1. Cheap tier, fitted to the full model on a calibration sample unless given
+    groups = [np.arange(n)] if material is None else [np.flatnonzero(material == m) for m in np.unique(material)]
+    fit = estimator is None
+    if fit:
+        rng = np.random.default_rng(seed)
+        sample = np.concatenate([rng.choice(g, min(calibration, len(g)), replace=False) for g in groups])
+        P[sample] = _loss(model, B[sample], frequency[sample], temperature[sample],
+                          None if material is None else material[sample])
+
+    for rounds in range(1, max_rounds + 1):
+        if fit:
+            # Refit on all full model outputs so far, which concentrate on the shortlist in later rounds
+            fitted = [SteinmetzEstimator().fit(B[g], frequency[g], temperature[g], P[g])
+                      for g in (g[~np.isnan(P[g])] for g in groups)]
+            estimator = fitted[0] if material is None else dict(zip(np.unique(material), fitted))
+        estimate = _loss(estimator, B, frequency, temperature, material)
+
+        # 2. Shortlist with the safety margin
+        shortlist = np.zeros(n, dtype=bool)
+        order = np.argsort(estimate)
+        kth = None
+        if k is not None:
+            k = min(k, n)
+            kth = estimate[order[k - 1]]
+            shortlist |= estimate <= kth * (1 + margin)
+        if threshold is not None:
+            shortlist |= estimate <= threshold * (1 + margin)
+
+        # 3. Full tier on the shortlist, until a refitted estimator adds no new candidates
+        missing = shortlist & np.isnan(P)
+        if not np.any(missing):
+            break
+        P[missing] = _loss(model, B[missing], frequency[missing], temperature[missing],
+                           None if material is None else material[missing])
+        if not fit:
+            break
+    listed = np.flatnonzero(shortlist)
+    index = listed[np.argsort(P[listed])][:k] if k is not None else listed[np.argsort(P[listed])]
+    passed = None if threshold is None else shortlist & (P <= threshold)
+
+    # 4. Report on the ranking changes between both tiers
+    error = np.abs(estimate[listed] / P[listed] - 1)
+    report = {
+        "candidates": n,
+        "evaluated": int(np.count_nonzero(~np.isnan(P))),
+        "shortlist": len(listed),
+        "rounds": rounds,
+        # Share of the shortlisted pairs ordered differently by both tiers
+        "swapped_pairs": float((1 - kendalltau(estimate[listed], P[listed])[0]) / 2) if len(listed) > 1 else 0.0,
+        "estimate_error": {"median": float(np.median(error)), "max": float(np.max(error))} if len(listed) else None,
+    }
+    if k is not None:
+        report["top_k_changed"] = int(k - len(np.intersect1d(index, order[:k])))
+        # The margin the final top k actually needed, larger than `margin` hints at missed candidates
+        report["required_margin"] = float(np.max(estimate[index]) / kth - 1)
+    if threshold is not None:
+        report["threshold_flips"] = int(np.count_nonzero((estimate[listed] <= threshold) != (P[listed] <= threshold)))
+    return {"index": index, "p": P, "estimate": estimate, "shortlist": shortlist, "passed": passed, "report": report}
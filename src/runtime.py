@@ -0,0 +1,252 @@
+"""
+File contains the CPU thread topology of the inference workers.
+
+Several workers on one host must split the cores between them instead of each letting torch
+use all of them. The topology is set through the API or the environment variables:
+    MAGNET_INTRA_OP_THREADS   threads used inside one operator (torch.set_num_threads)
+    MAGNET_INTER_OP_THREADS   threads running independent operators (process-wide, set once)
+    MAGNET_CPU_AFFINITY       cores the worker is pinned to, e.g. "0-3" or "0,2,4-5" (Linux only)
+
+Several models, e.g. both teams, run concurrently on the same batch through an Ensemble, each in
+its own worker process with a fixed thread budget.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import multiprocessing
+import os
+import threading
+import warnings
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+
+ENV_INTRA_OP = "MAGNET_INTRA_OP_THREADS"
+ENV_INTER_OP = "MAGNET_INTER_OP_THREADS"
+ENV_CPU_AFFINITY = "MAGNET_CPU_AFFINITY"
+
+# torch.set_num_threads is process-wide: scopes hold this lock, so only one applies at a time
+_scope_lock = threading.RLock()
+
+
+def parse_cores(text):
+    """
+    Parse a core list in taskset notation.
+
+    Args:
+        text (string): The core list, e.g. "0-3,8".
+    """
+    cores = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cores.update(range(int(first), int(last) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+class ThreadTopology:
+    """
+    Intra-op threads, inter-op threads and core pinning of a worker, or of one model call (see scope).
+
+    Parameters:
+    - intra_op: number of threads inside one operator (None keeps the current setting)
+    - inter_op: number of threads for independent operators (None keeps the current setting)
+    - cores: list of cores to pin to (None keeps the current affinity)
+    """
+
+    def __init__(self, intra_op=None, inter_op=None, cores=None):
+        self.intra_op = intra_op
+        self.inter_op = inter_op
+        self.cores = sorted(cores) if cores is not None else None
+        # By default one intra-op thread per pinned core
+        if self.intra_op is None and self.cores is not None:
+            self.intra_op = len(self.cores)
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """
+        Read the topology from the MAGNET_* environment variables.
+
+        Args:
+            environ (dictionary): The environment, defaults to os.environ.
+        """
+        environ = os.environ if environ is None else environ
+        intra_op = environ.get(ENV_INTRA_OP)
+        inter_op = environ.get(ENV_INTER_OP)
+        cores = environ.get(ENV_CPU_AFFINITY)
+        return cls(
+            intra_op=int(intra_op) if intra_op else None,
+            inter_op=int(inter_op) if inter_op else None,
+            cores=parse_cores(cores) if cores else None,
+        )
+
+    def __repr__(self):
+        return f"ThreadTopology(intra_op={self.intra_op}, inter_op={self.inter_op}, cores={self.cores})"
+
+    def apply(self):
+        """
+        Apply the topology to the whole process.
+
+        Call it once at worker start-up, before the first prediction: torch only accepts the inter-op
+        setting before any inter-op work ran, and threads started later inherit the affinity.
+        """
+        if self.cores is not None and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cores)
+        if self.inter_op is None and self.intra_op is None:
+            return self
+        import torch  # imported on demand, so that workers without thread settings start faster
+
+        if self.inter_op is not None and self.inter_op != torch.get_num_interop_threads():
+            try:
+                torch.set_num_interop_threads(self.inter_op)
+            except RuntimeError as error:
+                warnings.warn(f"Inter-op threads kept at {torch.get_num_interop_threads()}: {error}")
+        if self.intra_op is not None:
+            torch.set_num_threads(self.intra_op)
+        return self
+
+    @contextmanager
+    def scope(self):
+        """
+        Apply the intra-op threads and the core pinning of the calling thread temporarily.
+
+        The intra-op setting of torch is process-wide, not per thread. Scopes therefore hold a
+        module-level lock: scopes entered from other threads wait until this one is left, so calls
+        within scopes run one at a time. ONNX Runtime sessions created inside the scope use the same
+        thread counts.
+        """
+        import torch
+
+        with _scope_lock:
+            previous_threads = torch.get_num_threads()
+            previous_cores = None
+            if self.cores is not None and hasattr(os, "sched_setaffinity"):
+                previous_cores = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, self.cores)
+            if self.intra_op is not None:
+                torch.set_num_threads(self.intra_op)
+            try:
+                yield self
+            finally:
+                torch.set_num_threads(previous_threads)
+                if previous_cores is not None:
+                    os.sched_setaffinity(0, previous_cores)
+
+
+class ThreadedModel:
+    """
+    Run a core loss model within its own thread topology.
+
+    Every call enters ThreadTopology.scope, so calls of threaded models from several threads are
+    serialized rather than racing on the process-wide intra-op setting.
+
+    Parameters:
+    - mdl: the model instance (PaderbornModel, SydneyModel or a MagNet Toolkit LossModel)
+    - topology: the ThreadTopology, read from the environment if omitted
+    """
+
+    def __init__(self, mdl, topology=None):
+        self.mdl = mdl
+        self.topology = topology if topology is not None else ThreadTopology.from_env()
+
+    def __call__(self, *args, **kwargs):
+        with self.topology.scope():
+            return self.mdl(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.mdl, name)
+
+
+# The model of an ensemble worker process
+_worker_model = None
+
+
+def _start_worker(loader, topology):
+    """Apply the thread topology of an ensemble worker process once and load its model."""
+    global _worker_model
+    topology.apply()
+    _worker_model = loader()
+
+
+def _run_worker(*args):
+    """Run the model of an ensemble worker process and measure its wall time."""
+    start = perf_counter()
+    p, h = _worker_model(*args)
+    return np.atleast_1d(np.asarray(p, dtype=float)), np.asarray(h, dtype=float), perf_counter() - start
+
+
+class Ensemble:
+    """
+    Evaluate several core loss models concurrently on the same batch, e.g. both teams for a spread.
+
+    Every model runs in its own worker process, so the wall time is close to the slowest model
+    instead of the sum. The intra-op threads of torch are a process-wide setting: each worker applies
+    its thread topology once at start-up, and the budgets keep the models from oversubscribing the
+    cores. The workers are spawned, so the loaders must be picklable (e.g. functools.partial of a
+    model class and its arguments), and the batches and results are copied between the processes.
+
+    Parameters:
+    - loaders: dictionary of name: function returning the model, all called with (B, frequency, temperature)
+    - topologies: dictionary of name: ThreadTopology, by default the intra-op threads of the calling
+      process are split evenly between the models (at least one each)
+    """
+
+    def __init__(self, loaders, topologies=None):
+        self.names = list(loaders)
+        if topologies is None:
+            import torch
+
+            total = torch.get_num_threads()
+            share, rest = divmod(total, len(self.names))
+            topologies = {name: ThreadTopology(intra_op=max(1, share + (i < rest)))
+                          for i, name in enumerate(self.names)}
+        self.topologies = topologies
+        # Forking a process with a running OpenMP pool is unsafe, the workers start fresh
+        context = multiprocessing.get_context("spawn")
+        self._executors = {name: ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_start_worker,
+                                                     initargs=(loaders[name], self.topologies[name]))
+                           for name in self.names}
+
+    def __call__(self, B, frequency, temperature):
+        """
+        Evaluate all models on the same batch.
+
+        Args:
+            B (np.array): The flux density in T, one period per row.
+            frequency (np.array): The frequency in Hz.
+            temperature (np.array): The temperature in °C.
+
+        Return:
+            A dictionary with the per-row mean "p" and "h" over the models, their spread (maximum minus
+            minimum) "p_spread" and "h_spread", the results (p, h) of every model in "models", the
+            wall time of every model in "times" and the total "wall_time" in seconds.
+        """
+        start = perf_counter()
+        futures = {name: executor.submit(_run_worker, B, frequency, temperature)
+                   for name, executor in self._executors.items()}
+        results = {name: future.result() for name, future in futures.items()}
+        wall_time = perf_counter() - start
+
+        p = np.stack([result[0] for result in results.values()])
+        h = np.stack([np.atleast_2d(result[1]) for result in results.values()])
+        return {
+            "p": p.mean(axis=0),
+            "p_spread": np.ptp(p, axis=0),
+            "h": h.mean(axis=0),
+            "h_spread": np.ptp(h, axis=0),
+            "models": {name: result[:2] for name, result in results.items()},
+            "times": {name: result[2] for name, result in results.items()},
+            "wall_time": wall_time,
+        }
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
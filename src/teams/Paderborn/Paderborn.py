@@ -4,10 +4,22 @@ File contains the model according to the Paderborn University approach for the m
 Source: https://github.com/upb-lea/hardcore-magnet-challenge
 """
 
+import io
+import sys
+
+from os.path import abspath, dirname
+
 import numpy as np
 import pandas as pd
 import torch
 
+# Preprocessing shared by the team models
+if dirname(dirname(abspath(__file__))) not in sys.path:
+    sys.path.append(dirname(dirname(abspath(__file__))))
+from prediction import Prediction
+from pipeline import as_chunk, budget_rows, pipelined, row_memory, split_batch
+from preprocessing import resample_periodic
+
 
 L = 1024  # expected sequence length
 ALL_B_COLS = [f"B_t_{k}" for k in range(L)]
@@ -189,6 +201,20 @@ NORM_DENOM = {
     },
 }
 
+# Reduced-precision inference modes and their relative tolerances (p, h) against float32
+PRECISIONS = ("float32", "bfloat16", "int8")
+PRECISION_TOL = {
+    "bfloat16": {"p": 0.02, "h": 0.05},
+    "int8": {"p": 0.05, "h": 0.10},
+}
+MAT_PRECISION_TOL = {}  # per-material overrides, e.g. {"N87": {"int8": {"p": 0.03, "h": 0.1}}}
+
+# Inference runtimes of the network, and the relative tolerances (p, h) of ONNX Runtime against TorchScript
+BACKENDS = ("torch", "onnxruntime")
+BACKEND_TOL = {"p": 2e-3, "h": 1e-3}
+ONNX_INPUTS = ["x_ts", "x_scalars"]
+ONNX_OPSET = 17
+
 MAT2FILENAME = {
     "3C90": "cnn_3C90_experiment_1b4d8_model_f3915868_seed_0_fold_0.pt",
     "3C92": "cnn_3C92_experiment_ea1fe_model_72510647_seed_0_fold_0.pt",
@@ -470,6 +496,261 @@ def construct_tensor_seq2seq(
     return torch.dstack(tens_l), torch.tensor(X.to_numpy(), dtype=torch.float32)
 
 
+def construct_tensor_autograd(b_seq, freq, temp, material, b_limit, h_limit):
+    """
+    Differentiable counterpart of `engineer_features` and `construct_tensor_seq2seq` for inference.
+
+    The network inputs are built from torch tensors with the same operations and float32 casts, so that
+    gradients flow back to the flux density samples and the operating points. The waveform class is
+    piecewise constant in b_seq and enters as a constant one-hot encoding.
+
+    Args
+    ----
+    b_seq: (X, L) torch.Tensor
+        The magnetic flux density in T, one period per row.
+    freq, temp: (X,) torch.Tensor
+        The frequency in Hz and the temperature in °C.
+    material: str
+        The material name.
+    b_limit, h_limit: float
+        The material constants for the normalization.
+
+    Return
+    ------
+    x_ts, x_scalars, h_lim: (X, 5, L), (X, 11), (X, 1) torch.Tensor
+        The network inputs (time series, scalars and per-profile H limit).
+    """
+    denom = NORM_DENOM[material]
+    waveforms = get_waveform_est(b_seq.detach().cpu().numpy())
+    wav = torch.nn.functional.one_hot(torch.from_numpy(waveforms), 4).to(b_seq)
+
+    # scalar features, in the column order of engineer_features with freq first
+    dbdt = b_seq[:, 1:] - b_seq[:, :-1]
+    b_peak2peak = b_seq.amax(dim=1) - b_seq.amin(dim=1)
+    mean_abs_dbdt = torch.mean(torch.abs(dbdt), dim=1)
+    X = torch.column_stack(
+        [freq, temp, wav, b_peak2peak, torch.log(b_peak2peak), mean_abs_dbdt, torch.log(mean_abs_dbdt), 1 / freq]
+    ).float()
+    orig_freq = X[:, [0]]
+    X = torch.column_stack(
+        [
+            torch.log(X[:, [0]] / np.float32(FREQ_SCALE)),
+            X[:, [1]] / np.float32(75.0),
+            X[:, 2:6],
+            *[X[:, [6 + k]] / denom[c] for k, c in
+              enumerate(["b_peak2peak", "log_peak2peak", "mean_abs_dbdt", "log_mean_abs_dbdt", "sample_time"])],
+        ]
+    )
+
+    # time series features
+    full_b = b_seq / b_limit
+    b_limit_pp = torch.abs(b_seq).amax(dim=1, keepdim=True)
+    per_profile_scaled_b = full_b * b_limit / b_limit_pp
+    b_deriv = torch.cat([per_profile_scaled_b[:, -1:], per_profile_scaled_b, per_profile_scaled_b[:, :1]], dim=1)
+    b_deriv = torch.gradient(b_deriv, dim=1)[0] * orig_freq
+    b_deriv_sq = torch.gradient(b_deriv, dim=1)[0] * orig_freq
+    tantan_b = -torch.tan(0.9 * torch.tan(per_profile_scaled_b)) / 6
+    x_ts = torch.stack(
+        [
+            per_profile_scaled_b,
+            b_deriv[:, 1:-1] / denom["b_deriv"],
+            b_deriv_sq[:, 1:-1] / denom["b_deriv_sq"],
+            tantan_b,
+            full_b,
+        ],
+        dim=1,
+    ).float()
+    h_lim = (h_limit * b_limit_pp / b_limit).float()
+    return x_ts, X, h_lim
+
+
+def calibration_waveforms(n=48, seed=0):
+    """
+    Generate a seeded set of sine, triangular and trapezoidal waveforms with operating points.
+
+    Used to validate reduced-precision modes against float32 before they are activated.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, L, endpoint=False)
+    b_seq = np.empty((n, L))
+    for i in range(n):
+        match i % 3:
+            case 0:
+                b_seq[i] = np.sin(2 * np.pi * t)
+            case 1:
+                duty = rng.uniform(0.1, 0.9)
+                b_seq[i] = np.interp(t, [0, duty, 1], [-1, 1, -1])
+            case 2:
+                duty1, duty2 = rng.uniform(0.1, 0.4, 2)
+                flat = (1 - duty1 - duty2) / 2
+                b_seq[i] = np.interp(t, np.cumsum([0, duty1, flat, duty2, flat]), [-1, 1, 1, -1, -1])
+        b_seq[i] = np.roll(b_seq[i], rng.integers(L))
+    b_seq *= rng.uniform(0.02, 0.25, (n, 1))
+    freq = rng.uniform(50e3, 450e3, n)
+    temp = rng.choice([25.0, 50.0, 70.0, 90.0], n)
+    return b_seq, freq, temp
+
+
+class TemporalBlock(torch.nn.Module):
+    """Eager counterpart of the dilated, circularly padded convolution block of the TorchScript model."""
+
+    def __init__(self, in_channels, out_channels, kernel_size, dilation, padding, activation, residual):
+        super().__init__()
+        self.padding = padding
+        self.residual = residual
+        self.conv1 = torch.nn.Conv1d(in_channels, out_channels, kernel_size, dilation=dilation)
+        self.relu1 = torch.nn.Tanh() if activation == "Tanh" else torch.nn.Identity()
+
+    def forward(self, x):
+        """Circular padding is applied explicitly, so the convolution can be quantized."""
+        out = self.relu1(self.conv1(torch.nn.functional.pad(x, (self.padding, self.padding), mode="circular")))
+        if self.residual:
+            return torch.relu(torch.clamp(out + x, -10, 10))
+        return out
+
+
+class TCNWithScalarsAsBias(torch.nn.Module):
+    """Eager counterpart of the H predictor of the TorchScript model."""
+
+    def __init__(self, ts_branch, upper_tcn, scalar_branch):
+        super().__init__()
+        self.ts_branch = ts_branch
+        self.upper_tcn = upper_tcn
+        self.scalar_branch = scalar_branch
+
+    def forward(self, x_ts, x_scalars):
+        """Add the processed scalars as bias to the last time series channels."""
+        b_proc = self.ts_branch(x_ts)
+        scalar_proc = self.scalar_branch(x_scalars)
+        n_scalars = scalar_proc.size(1)
+        catted = torch.cat(
+            [b_proc[:, :-n_scalars, :], b_proc[:, -n_scalars:, :] + scalar_proc.unsqueeze(-1)], dim=1
+        )
+        y = self.upper_tcn(catted) + x_ts[:, [0], :]
+        return y - y.mean(dim=-1, keepdim=True)
+
+
+class LossPredictor(torch.nn.Module):
+    """Eager counterpart of the TorchScript model, used where the scripted graph cannot be transformed."""
+
+    def __init__(self, h_predictor, post_processor):
+        super().__init__()
+        self.h_predictor = h_predictor
+        self.post_processor = post_processor
+
+    @classmethod
+    def from_script(cls, scripted):
+        """Rebuild the eager modules from a loaded TorchScript model and copy its weights."""
+        blocks = []
+        for block in [scripted.h_predictor.ts_branch, *scripted.h_predictor.upper_tcn.children()]:
+            blocks.append(
+                TemporalBlock(
+                    block.conv1.in_channels,
+                    block.conv1.out_channels,
+                    block.conv1.kernel_size[0],
+                    block.conv1.dilation[0],
+                    block.conv1.padding[0],
+                    block.relu1.original_name,
+                    block.residual,
+                )
+            )
+        scalar_branch = torch.nn.Sequential(
+            *[torch.nn.Linear(m.in_features, m.out_features) if m.original_name == "Linear" else torch.nn.Tanh()
+              for m in scripted.h_predictor.scalar_branch.children()]
+        )
+        post_processor = torch.nn.Sequential(
+            *[torch.nn.Linear(m.in_features, m.out_features) if m.original_name == "Linear" else torch.nn.Tanh()
+              for m in scripted.post_processor.children()]
+        )
+        mdl = cls(TCNWithScalarsAsBias(blocks[0], torch.nn.Sequential(*blocks[1:]), scalar_branch), post_processor)
+        state_dict = {k: v for k, v in scripted.state_dict().items() if ".net." not in k}
+        mdl.load_state_dict(state_dict, strict=True)
+        return mdl.eval()
+
+    def network(self, x_ts, x_scalars):
+        """Return the normalized H sequence and the output of the post-processor."""
+        return self.h_predictor(x_ts, x_scalars).permute(2, 0, 1), self.post_processor(x_scalars)
+
+    def forward(self, x_ts, x_scalars, b_lim, h_lim, freq_scale):
+        """Return the log power loss and the normalized H sequence, same as the TorchScript model."""
+        h_pred, post = self.network(x_ts, x_scalars)
+        return log_loss(h_pred, post, x_ts, x_scalars, b_lim, h_lim, freq_scale), h_pred
+
+
+class LossPredictorExport(torch.nn.Module):
+    """Expose LossPredictor.network as forward, which is what torch.onnx.export traces."""
+
+    def __init__(self, mdl):
+        super().__init__()
+        self.mdl = mdl
+
+    def forward(self, x_ts, x_scalars):
+        return self.mdl.network(x_ts, x_scalars)
+
+
+def log_loss(h_pred, post, x_ts, x_scalars, b_lim, h_lim, freq_scale):
+    """
+    Integrate the log power loss of the TorchScript model from the network outputs.
+
+    The loop integral sums (B + 5) * dH over the cycle, whose offset terms only cancel up to the float32
+    rounding. The rounding noise depends on the summation order, so the integral is always evaluated by
+    this expression, whatever runtime produced h_pred.
+    """
+    freq = freq_scale * torch.exp(x_scalars[:, [0]])
+    scaled_b = x_ts[:, [-1], :].permute(2, 0, 1)
+    b_with_offset = b_lim * scaled_b + 5
+    h_with_offset = h_lim * h_pred + 5
+    ploss_pred = (
+        freq
+        * (post * 0.1 + 0.5)
+        * torch.abs(
+            torch.sum(b_with_offset * (torch.roll(h_with_offset, 1, 0) - torch.roll(h_with_offset, -1, 0)), 0)
+        )
+    )
+    return torch.log(ploss_pred)
+
+
+class OnnxLossPredictor:
+    """ONNX Runtime session of the network, with the call signature of the TorchScript model."""
+
+    def __init__(self, onnx_model):
+        try:
+            import onnxruntime as ort
+        except ImportError as error:
+            raise ImportError("The 'onnxruntime' backend requires the onnxruntime package") from error
+        # Follow the torch thread settings in effect when the session is created
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = torch.get_num_interop_threads()
+        self.session = ort.InferenceSession(onnx_model, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, x_ts, x_scalars, b_lim, h_lim, freq_scale):
+        """Run the graph on the CPU and integrate the loss in torch, returning torch tensors."""
+        inputs = dict(zip(ONNX_INPUTS, (t.cpu().numpy() for t in (x_ts, x_scalars))))
+        h, post = (torch.from_numpy(output) for output in self.session.run(None, inputs))
+        return log_loss(h, post, x_ts.cpu(), x_scalars.cpu(), b_lim, h_lim, freq_scale), h
+
+
+def relative_errors(p, h, p_ref, h_ref):
+    """Maximum relative error of p and maximum peak-normalized error of h against a reference."""
+    return {
+        "p": float(np.max(np.abs(p - p_ref) / np.abs(p_ref))),
+        "h": float(np.max(np.max(np.abs(h - h_ref), axis=1) / np.max(np.abs(h_ref), axis=1))),
+    }
+
+
+def quantize_int8(scripted):
+    """
+    Dynamically quantize the linear layers of a TorchScript model to int8.
+
+    The convolutions stay in float32: the dynamically quantized Conv1d of torch is flagged as numerically
+    unreliable, and loses up to 100 % of the power loss accuracy on the calibration set.
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        LossPredictor.from_script(scripted), {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
 class PaderbornModel:
     """The Paderborn model.
 
@@ -480,66 +761,267 @@ class PaderbornModel:
 
     """
 
-    def __init__(self, model_path, material):
+    def __init__(self, model_path, material, precision="float32", backend="torch", onnx_path=None):
         self.model_path = model_path
         self.material = material
         self.mdl = torch.jit.load(model_path)
         self.mdl.eval()
+        self.mdl_float32 = self.mdl
         assert (
             material in MAT_CONST_H_MAX and material in MAT_CONST_B_MAX
         ), f"Requested material '{material}' is not supported"
         self.b_limit = MAT_CONST_B_MAX[material]
         self.h_limit = MAT_CONST_H_MAX[material]
+        # constant network inputs, built once instead of on every call
+        self.b_limit_torch = torch.tensor(self.b_limit, dtype=torch.float32)
+        self.freq_scale_torch = torch.tensor(FREQ_SCALE, dtype=torch.float32)
         self.predicts_p_directly = True
+        self.precision = "float32"
+        self.backend = "torch"
+        self.validation_errors = None
+        self.mdl_eager = None  # eager float32 network for gradients, built on first use
+        self.row_bytes = {}  # peak memory per row of the stages by (sequence length, precision, backend)
+        if precision != "float32":
+            self.set_precision(precision)
+        if backend != "torch":
+            self.set_backend(backend, onnx_path)
+
+    def _reset(self):
+        """Fall back to the float32 TorchScript network."""
+        self.mdl, self.precision, self.backend, self.validation_errors = self.mdl_float32, "float32", "torch", None
+
+    def _validate(self, label, tol, activate, calibration=None):
+        """Activate a network variant, keeping it only if it reproduces the float32 outputs within `tol`."""
+        b_seq, freq, temp = calibration if calibration is not None else calibration_waveforms()
+        p_ref, h_ref = self(b_seq, freq, temp)
+        activate()
+        p, h = self(b_seq, freq, temp)
+        errors = relative_errors(p, h, p_ref, h_ref)
+        if errors["p"] > tol["p"] or errors["h"] > tol["h"]:
+            self._reset()
+            raise ValueError(
+                f"{label} rejected for material '{self.material}': relative errors "
+                f"p={errors['p']:.2e}, h={errors['h']:.2e} exceed tolerances p={tol['p']:.2e}, h={tol['h']:.2e}"
+            )
+        self.validation_errors = errors
+        return errors
+
+    def set_precision(self, precision, calibration=None):
+        """Switch the network to a reduced-precision mode after validating it against float32.
+
+        Args
+        ----
+        precision: str
+            One of "float32", "bfloat16" (autocast of the conv/linear layers) or "int8" (dynamic quantization
+             of the linear layers).
+        calibration: tuple of (b_seq, frequency, temperature), optional
+            The validation data, defaults to `calibration_waveforms()`.
+
+        Return
+        ------
+        errors: dict
+            The maximum relative errors of p and h against float32. A ValueError is raised and float32 is kept
+             if they exceed the material tolerances.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Precision '{precision}' not supported. Must be in {', '.join(PRECISIONS)}")
+        self._reset()
+        if precision == "float32":
+            return None
+
+        def activate():
+            self.mdl = quantize_int8(self.mdl_float32) if precision == "int8" else self.mdl_float32
+            self.precision = precision
+
+        tol = MAT_PRECISION_TOL.get(self.material, {}).get(precision, PRECISION_TOL[precision])
+        return self._validate(f"Precision '{precision}'", tol, activate, calibration)
+
+    def export_onnx(self, path=None):
+        """Export the float32 network to ONNX, consuming the tensors built by `construct_tensor_seq2seq`.
+
+        The graph returns the normalized H sequence and the post-processor output. The loss integral stays in
+        torch (`log_loss`), so that its float32 rounding matches the TorchScript model.
 
-    def __call__(self, b_seq, frequency, temperature):
+        Args
+        ----
+        path: str or path-like, optional
+            The output file. The serialized graph is returned as bytes if omitted.
+        """
+        n_scalars = next(self.mdl_float32.h_predictor.scalar_branch.children()).in_features
+        dummy = (torch.zeros(2, 5, L), torch.zeros(2, n_scalars))
+        target = io.BytesIO() if path is None else path
+        torch.onnx.export(
+            LossPredictorExport(LossPredictor.from_script(self.mdl_float32)),
+            dummy,
+            target,
+            input_names=ONNX_INPUTS,
+            output_names=["h", "post"],
+            dynamic_axes={"x_ts": {0: "batch"}, "x_scalars": {0: "batch"}, "h": {1: "batch"}, "post": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+        return target.getvalue() if path is None else None
+
+    def set_backend(self, backend, onnx_path=None, calibration=None):
+        """Select the runtime of the network after validating it against the TorchScript outputs.
+
+        Args
+        ----
+        backend: str
+            "torch" (TorchScript) or "onnxruntime" (ONNX Runtime on CPU, float32 only).
+        onnx_path: str or path-like, optional
+            A graph written by `export_onnx`. The network is exported in memory if omitted.
+        calibration: tuple of (b_seq, frequency, temperature), optional
+            The validation data, defaults to `calibration_waveforms()`.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend '{backend}' not supported. Must be in {', '.join(BACKENDS)}")
+        self._reset()
+        if backend == "torch":
+            return None
+
+        def activate():
+            self.mdl = OnnxLossPredictor(onnx_path if onnx_path is not None else self.export_onnx())
+            self.backend = backend
+
+        return self._validate(f"Backend '{backend}'", BACKEND_TOL, activate, calibration)
+
+    def __call__(self, b_seq, frequency, temperature, loss_only=False, chunk_size=None, memory_budget=None,
+                 out=None):
         """Evaluate trajectory and estimate power loss.
 
         Args
         ----
         b_seq: (X, Y) array_like
-            The magnetic flux density array(s) in T. First dimension X describes the batch, the second Y
-             the time length (will always be interpolated to 1024 samples)
+            The magnetic flux density array(s) in T, one period each. First dimension X describes the batch,
+             the second Y the time length (will always be resampled to 1024 samples with the FFT)
         frequency: scalar or 1D array-like
             The frequency operation point(s) in Hz
         temperature: scalar or 1D array-like
             The temperature operation point(s) in °C
+        loss_only: bool
+            Return a `Prediction` instead: p is computed at once, the rescaling, resampling and casting of h
+             only run when its `h` attribute is accessed.
+        chunk_size: int, optional
+            Process larger batches in chunks of rows, preparing the next chunk in a background thread while
+             the network runs on the current one (see pipeline.py). Inputs larger than the memory are streamed
+             with `predict_iter`.
+        memory_budget: int, optional
+            The working memory in bytes on top of the inputs and results. Sets chunk_size from the measured peak
+             memory per row of the stages (see `chunk_rows`).
+        out: tuple of np.ndarray, optional
+            Float32 buffers of shape (X,) and (X, Y) that receive p and h, e.g. reused across repeated calls with
+             the same batch shape. They are returned instead of newly allocated arrays.
         
         Return
         ------
         p, h: (X,) np.array, (X, Y) np.ndarray
-            The estimated power loss (p) in W/m³ and the estimated magnetic field strength (h) in A/m.
+            The estimated power loss (p) in W/m³ and the estimated magnetic field strength (h) in A/m,
+            sampled like b_seq.
+        """
+        b_seq = np.asarray(b_seq)
+        if memory_budget is not None and b_seq.ndim == 2:
+            chunk_size = self.chunk_rows(memory_budget, b_seq.shape[1])
+        if chunk_size is None or b_seq.ndim == 1 or len(b_seq) <= chunk_size:
+            return self._infer(self._prepare((b_seq, frequency, temperature)), loss_only, out)
+
+        # the chunks write into their rows of the output buffers, in order
+        chunk_out = iter([None if out is None else (out[0][first:first + chunk_size], out[1][first:first + chunk_size])
+                          for first in range(0, len(b_seq), chunk_size)])
+        results = list(pipelined(self._prepare, lambda prepared: self._infer(prepared, True, next(chunk_out)),
+                                 split_batch(b_seq, frequency, temperature, chunk_size)))
+        if out is None:
+            p_pred = np.concatenate([np.atleast_1d(result.p) for result in results])
+
+            def materialize():
+                return np.concatenate([result.h for result in results])
+        else:
+            p_pred = out[0]
+
+            def materialize():
+                for result in results:
+                    result.h  # materialized into its rows of out[1]
+                return out[1]
+
+        if loss_only:
+            return Prediction(p_pred, materialize)
+        return p_pred, materialize()
+
+    def chunk_rows(self, memory_budget, seq_len=L, depth=2, workers=1):
+        """The number of rows per chunk that keeps the pipeline within a memory budget in bytes.
+
+        The peak memory per row of the preprocessing and of the network is measured on a probe chunk the first
+        time a sequence length is seen with the current precision and backend.
+        """
+        key = (seq_len, self.precision, self.backend)
+        if key not in self.row_bytes:
+            infer = lambda prepared: self._infer(prepared, loss_only=True)
+            self.row_bytes[key] = row_memory(self._prepare, infer, 256, seq_len)
+        return budget_rows(memory_budget, *self.row_bytes[key], depth, workers)
+
+    def predict_iter(self, chunks, frequency=None, temperature=None, loss_only=False, depth=2, workers=1,
+                     ordered=True):
+        """Stream an iterable of chunks through the model.
+
+        Args
+        ----
+        chunks: iterable
+            (b_seq, frequency, temperature) tuples, or only b_seq (an array, a memory-mapped slice, a chunk of a
+             file reader, ...) evaluated at the default frequency and temperature. Consumed lazily.
+        frequency, temperature: scalar or 1D array-like, optional
+            The default operation points of chunks given without them.
+        loss_only: bool
+            Yield `Prediction` objects, as in the regular call.
+        depth: int
+            The number of prepared chunks that may wait for the network.
+        workers: int
+            The number of background threads preparing the chunks.
+        ordered: bool
+            Yield the results in the order of the chunks. Otherwise (index, result) pairs are yielded in the
+             order the chunks are prepared.
+
+        Return
+        ------
+        A generator of the results of each chunk, as returned by the regular call. At most depth+workers chunks
+        are in flight, a slow consumer stops the background threads (back-pressure).
         """
+        return pipelined(lambda item: self._prepare(as_chunk(item, frequency, temperature)),
+                         lambda prepared: self._infer(prepared, loss_only), chunks, depth, workers, ordered)
+
+    def _prepare(self, chunk):
+        """Resample, engineer the features and construct the tensors of a (b_seq, frequency, temperature) chunk."""
+        b_seq, frequency, temperature = chunk
+        seq_len = b_seq.shape[-1]
+        b_seq = resample_periodic(b_seq, L)
         ds = engineer_features(b_seq, frequency, temperature, self.material)
         # construct tensors
         x_cols = [c for c in ds if c not in ["ploss", "kfold", "material"] and not c.startswith(("B_t_", "H_t_"))]
         b_limit_per_profile = np.abs(ds.loc[:, ALL_B_COLS].to_numpy()).max(axis=1).reshape(-1, 1)
         h_limit = self.h_limit * b_limit_per_profile / self.b_limit
-        b_limit_test_fold = self.b_limit
-        b_limit_test_fold_pp = b_limit_per_profile
-        h_limit_test_fold = h_limit
         with torch.inference_mode():
             val_tensor_ts, val_tensor_scalar = construct_tensor_seq2seq(
                 ds,
                 x_cols,
-                b_limit_test_fold,
-                h_limit_test_fold,
-                b_limit_pp=b_limit_test_fold_pp,
+                self.b_limit,
+                h_limit,
+                b_limit_pp=b_limit_per_profile,
                 training_data=False,
             )
+        return val_tensor_ts, val_tensor_scalar, h_limit, b_seq, frequency, seq_len
 
+    def _infer(self, prepared, loss_only=False, out=None):
+        """Run the network on the tensors of `_prepare` and estimate p and h, into the buffers of out if given."""
+        val_tensor_ts, val_tensor_scalar, h_limit_test_fold, b_seq, frequency, seq_len = prepared
+        with torch.inference_mode(), torch.autocast("cpu", torch.bfloat16, enabled=self.precision == "bfloat16"):
             if self.predicts_p_directly:
-                # prepare torch tensors for normalization scales
-                b_limit_test_fold_torch = torch.as_tensor(b_limit_test_fold, dtype=torch.float32)
+                # prepare torch tensors for normalization scales, the constant ones are built at load
                 h_limit_test_fold_torch = torch.as_tensor(h_limit_test_fold, dtype=torch.float32)
-                freq_scale_torch = torch.as_tensor(FREQ_SCALE, dtype=torch.float32)
 
                 val_pred_p, val_pred_h = self.mdl(
                     val_tensor_ts.permute(1, 2, 0),
                     val_tensor_scalar,
-                    b_limit_test_fold_torch,
+                    self.b_limit_torch,
                     h_limit_test_fold_torch,
-                    freq_scale_torch,
+                    self.freq_scale_torch,
                 )
             else:
                 val_pred_h = self.mdl(
@@ -547,9 +1029,88 @@ class PaderbornModel:
                     val_tensor_scalar,
                 ).permute(2, 0, 1)
                 val_pred_p = None
-            h_pred = val_pred_h.squeeze().cpu().numpy().T * h_limit_test_fold
-            if val_pred_p is None:
-                p_pred = frequency * np.trapz(h_pred, b_seq, axis=1)
-            else:
-                p_pred = np.exp(val_pred_p.squeeze().cpu().numpy())
-        return p_pred.astype(np.float32), h_pred.astype(np.float32)
\ No newline at end of file
+
+        def materialize():
+            # Rescale and go back to the sampling of the input
+            with torch.inference_mode():
+                h_pred = val_pred_h.squeeze().float().cpu().numpy().T
+            if out is not None and seq_len == L:
+                # already at the sampling of the input, rescaled straight into the buffer
+                np.multiply(h_pred, h_limit_test_fold, out=out[1])
+                return out[1]
+            h_pred = h_pred * h_limit_test_fold
+            if out is None:
+                return resample_periodic(h_pred, seq_len).astype(np.float32)
+            out[1][...] = resample_periodic(h_pred, seq_len)
+            return out[1]
+
+        if val_pred_p is None:
+            h_pred = materialize()
+            p_pred = frequency * np.trapz(h_pred, b_seq, axis=1)
+            materialize = lambda: h_pred
+        else:
+            with torch.inference_mode():
+                p_log = val_pred_p.squeeze().float().cpu().numpy()
+            p_pred = np.exp(p_log) if out is None else np.exp(p_log, out=out[0].reshape(p_log.shape))
+        if out is None:
+            p_pred = p_pred.astype(np.float32)
+        else:
+            out[0][...] = p_pred
+            p_pred = out[0]
+        if loss_only:
+            return Prediction(p_pred, materialize)
+        return p_pred, materialize()
+
+    def sensitivity(self, b_seq, frequency, temperature, batch_size=1024):
+        """Estimate the power loss and its gradients with respect to all inputs in one forward/backward pass.
+
+        The features are built by `construct_tensor_autograd`, so the whole path from the input samples to
+        the power loss stays in PyTorch. Every profile only depends on its own inputs, hence the backward
+        pass of the summed power losses yields the per-profile gradients. Gradients always run through the
+        eager counterpart of the float32 network: the TorchScript executor specializes its graph to the
+        inference mode of `__call__`, which cannot record gradients.
+
+        Args
+        ----
+        b_seq: (X, Y) array_like
+            The magnetic flux density array(s) in T, one period each (resampled to 1024 samples with the FFT).
+        frequency: scalar or 1D array-like
+            The frequency operation point(s) in Hz
+        temperature: scalar or 1D array-like
+            The temperature operation point(s) in °C
+        batch_size: int
+            The profiles per forward/backward pass, bounds the memory of the autograd graph.
+
+        Return
+        ------
+        p, dp_db, dp_df, dp_dt: (X,), (X, Y), (X,), (X,) np.ndarray
+            The estimated power loss in W/m³ and its gradients in W/m³/T (per sample of b_seq), W/m³/Hz and
+            W/m³/°C.
+        """
+        b_seq = np.asarray(b_seq, dtype=np.float64)
+        b_seq = b_seq[np.newaxis, :] if b_seq.ndim == 1 else b_seq
+        frequency = np.broadcast_to(np.asarray(frequency, dtype=np.float64).reshape(-1), (len(b_seq),))
+        temperature = np.broadcast_to(np.asarray(temperature, dtype=np.float64).reshape(-1), (len(b_seq),))
+        if self.mdl_eager is None:
+            self.mdl_eager = LossPredictor.from_script(self.mdl_float32)
+        results = []
+        with torch.enable_grad():
+            for first in range(0, len(b_seq), batch_size):
+                b, freq, temp = (
+                    torch.tensor(data[first : first + batch_size], requires_grad=True)
+                    for data in (b_seq, frequency, temperature)
+                )
+                x_ts, x_scalars, h_lim = construct_tensor_autograd(
+                    resample_periodic(b, L), freq, temp, self.material, self.b_limit, self.h_limit
+                )
+                log_p, _ = self.mdl_eager(
+                    x_ts,
+                    x_scalars,
+                    torch.as_tensor(self.b_limit, dtype=torch.float32),
+                    h_lim,
+                    torch.as_tensor(FREQ_SCALE, dtype=torch.float32),
+                )
+                p = torch.exp(log_p.reshape(-1))
+                p.sum().backward()
+                results.append((p.detach().numpy(), b.grad.numpy(), freq.grad.numpy(), temp.grad.numpy()))
+        return tuple(np.concatenate(parts) for parts in zip(*results))
@@ -1,6 +1,16 @@
+import copy
+import io
+import sys
 import torch
 import numpy as np
-from scipy.signal import savgol_filter
+from os.path import abspath, dirname
+
+# Preprocessing shared by the team models
+if dirname(dirname(abspath(__file__))) not in sys.path:
+    sys.path.append(dirname(dirname(abspath(__file__))))
+from pipeline import as_chunk, budget_rows, pipelined, row_memory, split_batch
+from prediction import Prediction
+from preprocessing import resample_periodic
 
 # Material normalization data (1.B 2.H 3.F 4.T 5.dB/dt)
 normsDict ={"77":  [[-2.63253458e-19,  7.47821754e-02],
@@ -80,13 +90,31 @@ normsDict ={"77":  [[-2.63253458e-19,  7.47821754e-02],
                     [ 7.30377579e+00,  4.04136391e+01]],
              }
 
+# Reduced-precision inference modes and their relative tolerances (p, h) against float32.
+# Every Linear layer of the MMINet runs inside the recurrence, where quantization errors accumulate
+# over the warm-up and the period: int8 failed the validation on all 15 materials (P errors of 15% to
+# over 2000%) and is not offered. bfloat16 only passes for N30 and N87.
+PRECISIONS = ("float32", "bfloat16")
+PRECISION_TOL = {
+    "bfloat16": {"p": 0.02, "h": 0.05},
+}
+MAT_PRECISION_TOL = {}  # per-material overrides, e.g. {"N87": {"bfloat16": {"p": 0.03, "h": 0.1}}}
+
+# Inference runtimes of the network, and the relative tolerances (p, h) of ONNX Runtime against PyTorch
+BACKENDS = ("torch", "onnxruntime")
+BACKEND_TOL = {"p": 1e-3, "h": 1e-3}
+# Adaptive warm-up: maximum deviation from the fixed n_init warm-up on the calibration set
+WARMUP_TOL = {"p": 0.01, "h": 0.05}
+ONNX_OPSET = 17
+
 # %% Initialize model
 class SydneyModel:
     """The Sydney model."""
 
-    def __init__(self, mdl_path, material):
+    def __init__(self, mdl_path, material, precision="float32", backend="torch", onnx_path=None):
         # Select GPU as default device
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.material = material
 
         # 1.Create model isntances
         self.mdl = MMINet(material).to(self.device)   
@@ -94,36 +122,440 @@ class SydneyModel:
         # 2.Load specific model 
         state_dict = torch.load(mdl_path, map_location=self.device)
         self.mdl.load_state_dict(state_dict,strict=True)
-        
+
+        # 3.Select the inference precision and runtime
+        self.mdl_float32 = self.mdl
+        self.precision = "float32"
+        self.backend = "torch"
+        self.validation_errors = None
+        self.warmup = None          # adaptive warm-up settings, None for the fixed n_init steps
+        self.warmup_report = None   # warm-up steps of the last call in adaptive mode
+        self.row_bytes = {}         # peak memory per row of the stages by (sequence length, precision, backend)
+        if precision != "float32":
+            self.set_precision(precision)
+        if backend != "torch":
+            self.set_backend(backend, onnx_path)
+
+    def _reset(self):
+        """Fall back to the float32 PyTorch network."""
+        self.mdl, self.precision, self.backend, self.validation_errors = self.mdl_float32, "float32", "torch", None
+
+    def _validate(self, label, tol, activate, calibration=None, reset=None):
+        """Activate a network variant, keeping it only if it reproduces the float32 outputs within tol."""
+        data_B, data_F, data_T = calibration if calibration is not None else calibration_waveforms()
+        P_ref, H_ref = self(data_B, data_F, data_T)
+        activate()
+        P, H = self(data_B, data_F, data_T)
+        errors = relative_errors(P, H, P_ref, H_ref)
+        if errors["p"] > tol["p"] or errors["h"] > tol["h"]:
+            (reset or self._reset)()
+            raise ValueError(
+                f"{label} rejected for material '{self.material}': relative errors "
+                f"P={errors['p']:.2e}, H={errors['h']:.2e} exceed tolerances P={tol['p']:.2e}, H={tol['h']:.2e}")
+        self.validation_errors = errors
+        return errors
+
+    def set_precision(self, precision, calibration=None):
+        """
+        Switch the network to a reduced-precision mode after validating it against float32.
+
+        Parameters
+        ---------
+        precision : str
+             "float32" or "bfloat16" (autocast of the Linear layers in EddyCell/dnn1/dnn2).
+             bfloat16 passes the validation for N30 and N87 only, and runs at about 0.7-0.9x
+             the float32 speed on CPUs without native bfloat16 support.
+        calibration : tuple, optional
+             Validation data (B, F, T), defaults to calibration_waveforms()
+
+        Returns the maximum relative errors of P and H against float32. A ValueError is
+        raised and float32 is kept if they exceed the material tolerances.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Precision '{precision}' not supported. Must be in {', '.join(PRECISIONS)}")
+        self._reset()
+        if precision == "float32":
+            return None
+
+        def activate():
+            self.precision = precision
+
+        tol = MAT_PRECISION_TOL.get(self.material, {}).get(precision, PRECISION_TOL[precision])
+        return self._validate(f"Precision '{precision}'", tol, activate, calibration)
+
+    def export_onnx(self, path=None):
+        """
+        Export the network part of MMINet (forward_raw) to ONNX.
+
+        The graph consumes the tensors built by get_dataloader and returns the loss density and
+        the unsmoothed field strength; smoothing stays in MMINet.postprocess.
+
+        Parameters
+        ---------
+        path : str, optional
+             Output file, the serialized graph is returned as bytes if omitted
+        """
+        data_B, data_F, data_T = calibration_waveforms(n=2)
+        inputs, vars = next(iter(get_dataloader(data_B, data_F, data_T, self.mdl_float32.norm)))
+        target = io.BytesIO() if path is None else path
+        torch.onnx.export(MMINetExport(copy.deepcopy(self.mdl_float32).cpu()), (inputs, vars), target,
+                          input_names=["x", "var"], output_names=["Pv", "H"],
+                          dynamic_axes={"x": {0: "batch"}, "var": {0: "batch"},
+                                        "Pv": {0: "batch"}, "H": {0: "batch"}},
+                          opset_version=ONNX_OPSET)
+        return target.getvalue() if path is None else None
+
+    def set_backend(self, backend, onnx_path=None, calibration=None):
+        """
+        Select the runtime of the network after validating it against the PyTorch outputs.
+
+        Parameters
+        ---------
+        backend : str
+             "torch" or "onnxruntime" (ONNX Runtime on CPU, float32 only)
+        onnx_path : str, optional
+             Graph written by export_onnx, the network is exported in memory if omitted
+        calibration : tuple, optional
+             Validation data (B, F, T), defaults to calibration_waveforms()
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend '{backend}' not supported. Must be in {', '.join(BACKENDS)}")
+        self._reset()
+        if backend == "torch":
+            return None
+
+        def activate():
+            self.mdl = OnnxMMINet(onnx_path if onnx_path is not None else self.export_onnx(), self.mdl_float32)
+            self.backend = backend
+
+        return self._validate(f"Backend '{backend}'", BACKEND_TOL, activate, calibration)
     
-    def __call__(self, data_B, data_F, data_T):
-        """Call method."""
+    def __call__(self, data_B, data_F, data_T, loss_only=False, chunk_size=None, memory_budget=None, out=None):
+        """
+        Call method.
+
+        data_B holds one period per row in T at any resolution, it is resampled to 128 steps with the
+        FFT and the predicted H is resampled back to the input resolution.
+
+        With loss_only=True a Prediction is returned instead of (P, H): P is computed at once, the
+        smoothing, rotation and resampling of H only run when its h attribute is accessed.
+
+        With chunk_size, larger batches are processed in chunks of rows: the features of the next
+        chunk are built in a background thread while the network runs on the current one. Inputs
+        larger than the memory are streamed with predict_iter.
+
+        With memory_budget, the working memory in bytes on top of the inputs and results, the chunk
+        size follows from the measured peak memory per row of the stages (see chunk_rows), and each
+        chunk runs through the network as one batch instead of batches of 128 rows.
+
+        With out, float32 buffers of the shapes (N,) and (N, L) of P and H, the results are written
+        into the buffers and the buffers are returned, e.g. reused across repeated calls.
+        """
         # ----------------------------------------------------------- batch execution  
         # 1.Get dataloader
+        data_B = np.asarray(data_B)
         if data_B.ndim == 1:
-            data_B = np.array(data_B).reshape(1, -1)
+            data_B = data_B.reshape(1, -1)
+        seq_len = data_B.shape[1]
+        prepare = self._prepare
+        if memory_budget is not None:
+            chunk_size = self.chunk_rows(memory_budget, seq_len)
+            prepare = lambda chunk: self._prepare(chunk, batch_size=chunk_size)
+
+        if chunk_size is None or len(data_B) <= chunk_size:
+            results = [self._infer(prepare((data_B, data_F, data_T)))]
+        else:
+            results = list(pipelined(prepare, self._infer, split_batch(data_B, data_F, data_T, chunk_size)))
+        return self._finish(results, seq_len, loss_only, out)
+
+    def predict_iter(self, chunks, frequency=None, temperature=None, loss_only=False, depth=2, workers=1,
+                     ordered=True):
+        """
+        Stream an iterable of chunks through the model.
+
+        The chunks are (B, F, T) tuples, or only B (an array, a memory-mapped slice, a chunk of a file
+        reader, ...) with the default frequency and temperature. The iterable is consumed lazily, at
+        most depth+workers chunks are in flight, and the result of each chunk is yielded as from a
+        regular call. The features of the next chunks are built in `workers` background threads, a
+        slow consumer stops them (back-pressure). With ordered=False (index, result) pairs are yielded
+        in the order the chunks are prepared.
+        """
+        def prepare(item):
+            chunk = as_chunk(item, frequency, temperature)
+            return self._prepare(chunk), chunk[0].shape[1]
+
+        def infer(prepared):
+            loader, seq_len = prepared
+            return self._finish([self._infer(loader)], seq_len, loss_only)
+
+        return pipelined(prepare, infer, chunks, depth, workers, ordered)
+
+    def _finish(self, results, seq_len, loss_only, out=None):
+        """Join the network outputs of the chunks and return the results of the call, into out if given."""
+        data_P = np.concatenate([P for P, _, _ in results], out=None if out is None else out[0])
+        raw_H = [batch for _, batches, _ in results for batch in batches]
+        warmup_steps = [steps for _, _, chunk_steps in results for steps in chunk_steps]
+        if self.warmup is not None:
+            n_init = self.mdl_float32.n_init
+            total = sum(size for _, size, _ in warmup_steps)
+            self.warmup_report = {
+                "steps": [steps for steps, _, _ in warmup_steps],   # warm-up steps per batch
+                "saved": sum((n_init-steps)*size for steps, size, _ in warmup_steps)/(n_init*total),
+                "converged": sum(count for _, _, count in warmup_steps)/total,
+            }
 
-        loader = get_dataloader(data_B,data_F,data_T,self.mdl.norm)
+        def materialize():
+            # Smoothing and rotation of every batch, then back to the input resolution
+            h_batches = [self.mdl_float32.postprocess(*batch)[1] for batch in raw_H]
+            raw_H.clear()
+            if out is not None and h_batches[0].size(1) == seq_len:
+                torch.cat(h_batches, dim=0, out=torch.from_numpy(out[1]))
+                return out[1]
+            h_series = resample_periodic(torch.cat(h_batches, dim=0).numpy(), seq_len)
+            if out is not None:
+                out[1][...] = h_series
+                return out[1]
+            if h_series.ndim == 1:
+                h_series = h_series.reshape(1, -1)
+            return h_series
+
+        # 3.Return results 
+        if data_P.size == 1 and out is None:
+            data_P = data_P.item()
+        if loss_only:
+            return Prediction(data_P, materialize)
+        return data_P, materialize()
+
+    def chunk_rows(self, memory_budget, seq_len=128, depth=2, workers=1):
+        """
+        The number of rows per chunk that keeps the pipeline within a memory budget in bytes.
 
+        The peak memory per row of the feature construction and of the network, with one batch per
+        chunk, is measured on a probe chunk the first time a sequence length is seen with the current
+        precision and backend.
+        """
+        key = (seq_len, self.precision, self.backend)
+        if key not in self.row_bytes:
+            prepare = lambda chunk: self._prepare(chunk, batch_size=256)
+            self.row_bytes[key] = row_memory(prepare, self._infer, 256, seq_len)
+        return budget_rows(memory_budget, *self.row_bytes[key], depth, workers)
+
+    def _prepare(self, chunk, batch_size=128):
+        """Build the dataloader of a (B, F, T) chunk."""
+        return get_dataloader(*chunk, self.mdl.norm, batch_size=batch_size)
+
+    def _infer(self, loader):
+        """
+        Run the network on the batches of a dataloader.
+
+        Returns the loss densities, the raw outputs (loss density, unsmoothed field strength and
+        warm-up steps) of every batch for the post-processing, and the warm-up statistics of every
+        batch in adaptive mode.
+        """
         # 2.Validate the models
         data_P = torch.Tensor([]).to(self.device)  # Allocate memory to store loss density
+        raw_H = []  # loss density, unsmoothed field strength and warm-up steps of each batch
 
-        with torch.no_grad():
+        # ONNX Runtime only runs on the CPU
+        device = torch.device("cpu") if self.backend != "torch" else self.device
+        with torch.no_grad(), torch.autocast(device.type, torch.bfloat16, enabled=self.precision == "bfloat16"):
             # Start model evaluation explicitly
             self.mdl.eval()
+            warmup_steps = []
             for inputs, vars in loader:
-                    Pv, h_series = self.mdl(inputs.to(self.device), vars.to(self.device))
+                if self.warmup is None:
+                    Pv, H = self.mdl.forward_raw(inputs.to(device), vars.to(device))
+                    steps = None
+                else:
+                    # Adaptive warm-up, always on the PyTorch network
+                    mdl = self.mdl if self.backend == "torch" else self.mdl_float32
+                    Pv, H, steps, converged = mdl.forward_adaptive(inputs.to(device), vars.to(device),
+                                                                   **self.warmup)
+                    warmup_steps.append((steps, len(inputs), int(converged.sum())))
 
-                    data_P = torch.cat((data_P,Pv.to(self.device)),dim=0)
-        data_P, h_series = data_P.cpu().numpy(), h_series.cpu().numpy()
-        
-        # 3.Return results 
-        if data_P.size == 1:
-            data_P = data_P.item()
-        if h_series.ndim == 1:
-            h_series = h_series.reshape(1, -1)
-            
-        return data_P, h_series
+                data_P = torch.cat((data_P,Pv.to(self.device)),dim=0)
+                raw_H.append((Pv, H, steps))
+        return data_P.cpu().numpy(), raw_H, warmup_steps
+
+    def set_warmup(self, tol=None, quantile=1.0, calibration=None):
+        """
+        Select the fixed n_init warm-up (tol=None) or the adaptive warm-up (see MMINet.forward_adaptive).
+
+        The adaptive warm-up is only kept if its outputs on the calibration set stay within WARMUP_TOL
+        of the fixed warm-up, otherwise a ValueError is raised. Returns the deviations and the mean
+        share of the warm-up steps saved on the calibration set.
+
+        Parameters:
+        tol: float
+            Tolerance of the normalized eddy field strength for a waveform to count as converged
+        quantile: float
+            Share of converged waveforms at which a batch ends its warm-up
+        calibration: tuple
+            B, F, T of the calibration set
+        """
+        self.warmup = None
+        if tol is None:
+            return None
+
+        def activate():
+            self.warmup = {"tol": tol, "quantile": quantile}
+
+        def reset():
+            self.warmup = None
+
+        errors = self._validate(f"Adaptive warm-up (tol={tol})", WARMUP_TOL, activate, calibration, reset)
+        return {**errors, "saved": self.warmup_report["saved"]}
+
+    def sensitivity(self, data_B, data_F, data_T, batch_size=128):
+        """
+        Loss density and its gradients with respect to all inputs in one forward and backward pass.
+
+        The features are built with get_features, so the whole path from the input samples to the
+        loss density stays in PyTorch. Every waveform only depends on its own inputs, hence the
+        backward pass of the summed loss densities yields the per-waveform gradients. Gradients
+        always run through the float32 PyTorch network.
+
+        Parameters:
+        data_B: batch,seq (or seq)
+            One period of B in T per row at any resolution
+        data_F: scalar or batch
+            Frequency in Hz
+        data_T: scalar or batch
+            Temperature in °C
+        batch_size: int
+            Waveforms per forward/backward pass, bounds the memory of the autograd graph
+
+        Returns P (batch) in W/m³, dP/dB (batch,seq) in W/m³/T per sample of data_B, dP/df (batch)
+        in W/m³/Hz and dP/dT (batch) in W/m³/°C.
+        """
+        data_B = np.asarray(data_B, dtype=np.float64)
+        data_B = data_B.reshape(1, -1) if data_B.ndim == 1 else data_B
+        data_F = np.broadcast_to(np.asarray(data_F, dtype=np.float64).reshape(-1), (len(data_B),))
+        data_T = np.broadcast_to(np.asarray(data_T, dtype=np.float64).reshape(-1), (len(data_B),))
+
+        mdl = self.mdl_float32
+        mdl.eval()
+        results = []
+        with torch.enable_grad():
+            for first in range(0, len(data_B), batch_size):
+                B, F, T = (torch.tensor(data[first:first+batch_size], requires_grad=True)
+                           for data in (data_B, data_F, data_T))
+                inputs, vars = get_features(resample_periodic(B, 128).float(), torch.log10(F).view(-1, 1).float(),
+                                            T.view(-1, 1).float(), mdl.norm, mdl.n_init)
+                Pv, _ = mdl.forward_raw(inputs.to(self.device), vars.to(self.device))
+                Pv.sum().backward()
+                results.append((Pv.detach().cpu().numpy(), B.grad.numpy(), F.grad.numpy(), T.grad.numpy()))
+        mdl.rnn1_hx, mdl.rnn2_hx = None, None  # release the graph held by the recurrent states
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def stream(self, data_F, data_T, sample_rate=None):
+        """
+        Open a stateful stream for transient excitations arriving in chunks (see SydneyStream).
+
+        The ONNX Runtime backend runs whole sequences only, streams use the PyTorch network.
+        """
+        mdl = self.mdl if self.backend == "torch" else self.mdl_float32
+        return SydneyStream(mdl, data_F, data_T, sample_rate, self.device, self.precision)
+
+
+class SydneyStream:
+    """
+    Stateful streaming inference of the MMINet for transient simulation.
+
+    The stop operator and eddy cell states are kept between calls, so every chunk of B only
+    advances the recurrence by its own samples: no warm-up and no re-run of earlier samples.
+    Streams start demagnetized (zero operator states). H is returned unsmoothed, since the
+    Savitzky-Golay filter of the periodic mode is not causal.
+
+    A periodic excitation reaches the steady state of the stream after one period: from the second
+    period on, H repeats to within 1e-5 of its peak. This steady state is not the result of the
+    periodic mode (SydneyModel.__call__), however many periods are streamed. The periodic mode follows
+    its period with the warm-up B[1:1+n_init], skipping B[0], and the doubled flux density step at
+    this wrap shifts the eddy cells. For a 100 mT, 100 kHz sine at 25 °C, the last streamed period
+    differs from the periodic H by 5% to 12% of its peak over the 15 materials (7.9% for N87).
+    Streaming the sequence of the periodic mode, B followed by B[1:1+n_init], and smoothing and
+    rotating it as MMINet.postprocess does, reproduces the periodic H from the demagnetized state.
+
+    Parameters:
+    - mdl: the MMINet
+    - data_F: frequency of each stream in Hz (scalar or batch), an input feature of the network
+    - data_T: temperature of each stream in °C (scalar or batch)
+    - sample_rate: sample rate of B in Hz, defaults to 128 samples per period of data_F
+    - device: torch device
+    - precision: "float32" or "bfloat16"
+    """
+
+    def __init__(self, mdl, data_F, data_T, sample_rate=None, device=torch.device("cpu"), precision="float32"):
+        self.mdl = mdl
+        self.device = device
+        self.precision = precision
+        norm = mdl.norm
+        data_F = np.atleast_1d(np.asarray(data_F, dtype=np.float64))
+        data_T = np.atleast_1d(np.asarray(data_T, dtype=np.float64))
+        data_F, data_T = np.broadcast_arrays(data_F, data_T)
+        sample_rate = 128*data_F if sample_rate is None else np.broadcast_to(sample_rate, data_F.shape)
+
+        in_F = (torch.from_numpy(np.log10(data_F)).view(-1, 1).float()-norm[2][0])/norm[2][1]
+        in_T = (torch.tensor(data_T, dtype=torch.float32).view(-1, 1)-norm[3][0])/norm[3][1]
+        self.var = torch.cat((in_F, in_T), dim=1).to(device)
+        # dB/dt feature scale of get_dataloader (samples per period times log10 of the frequency)
+        scale = np.asarray(sample_rate)/data_F*np.log10(data_F)
+        self.dB_dt_scale = torch.from_numpy(scale).view(-1, 1).float().to(device)
+        self.reset()
+
+    def reset(self):
+        """Restart all streams from the demagnetized state."""
+        batch = self.var.size(0)
+        self.rnn1_hx = torch.zeros((batch, self.mdl.operator_size), device=self.device)
+        self.rnn2_hx = None
+        self.last_B = None   # last normalized B of the previous chunk
+        self.last_BH = None  # last B in T and H in A/m of the previous chunk
+        self.energy = np.zeros(batch)  # loss energy density integral of H dB since the start in J/m³
+        self.steps = 0
+
+    def __call__(self, data_B):
+        """
+        Advance the streams by one chunk.
+
+        Parameters:
+        data_B: batch,chunk (or chunk for a single stream)
+            Next samples of B in T
+
+        Returns H in A/m with the shape of data_B.
+        """
+        squeeze = np.ndim(data_B) == 1
+        data_B = np.asarray(data_B, dtype=np.float64).reshape(self.var.size(0), -1)
+        if data_B.shape[1] == 0:
+            return np.zeros(np.shape(data_B)[-1:] if squeeze else data_B.shape)
+        norm = self.mdl.norm
+
+        # Features, continuing the flux density change across the chunk boundary
+        in_B = (torch.tensor(data_B, dtype=torch.float32, device=self.device)-norm[0][0])/norm[0][1]
+        if self.last_B is None:
+            first = in_B[:, 1:2]-in_B[:, 0:1] if in_B.size(1) > 1 else torch.zeros_like(in_B[:, 0:1])
+            in_dB = torch.cat((first, torch.diff(in_B, dim=1)), dim=1)
+        else:
+            in_dB = torch.diff(torch.cat((self.last_B, in_B), dim=1), dim=1)
+        in_dB_dt = (in_dB*self.dB_dt_scale-norm[4][0])/norm[4][1]
+        x = torch.stack((in_B, in_dB, in_dB_dt), dim=2)
+
+        output = []
+        with torch.no_grad(), torch.autocast(self.device.type, torch.bfloat16, enabled=self.precision == "bfloat16"):
+            for t in range(x.size(1)):
+                H, self.rnn1_hx, self.rnn2_hx = self.mdl.step(x[:, t, :], self.var, self.rnn1_hx, self.rnn2_hx)
+                output.append(H.float())
+        self.last_B = in_B[:, -1:]
+        H = (torch.cat(output, dim=1)*norm[1][1]+norm[1][0]).cpu().numpy()
+        self.steps += data_B.shape[1]
+
+        # Loss energy of the chunk with the trapezoidal rule, joined to the previous chunk
+        B_joined, H_joined = data_B, H
+        if self.last_BH is not None:
+            B_joined = np.hstack((self.last_BH[0], data_B))
+            H_joined = np.hstack((self.last_BH[1], H))
+        self.energy += np.sum((H_joined[:, 1:]+H_joined[:, :-1])*np.diff(B_joined, axis=1), axis=1)/2
+        self.last_BH = (data_B[:, -1:], H[:, -1:])
+        return H[0] if squeeze else H
 
     
 
@@ -168,57 +600,209 @@ class MMINet(torch.nn.Module):
         var: batch,var_size
             Supplementary inputs (1.F 2.T)
         """    
+        Pv, H = self.forward_raw(x, var)
+        return self.postprocess(Pv, H)
+
+    def forward_raw(self, x, var):
+        """
+        Network part of the forward function, free of NumPy calls so it can be exported.
+
+        Parameters:
+        x: batch,seq,input_size
+            Input features (1.B, 2.dB, 3.dB/dt)
+        var: batch,var_size
+            Supplementary inputs (1.F 2.T)
+
+        Returns the loss density (batch) and the unsmoothed field strength (batch,seq-n_init,1).
+        """
         batch_size = x.size(0)          # Batch size 
         seq_size = x.size(1)            # Ser
         
         # Initialize operator state
         self.rnn1_hx = var[:,2:]
 
-        # Initialize DNN2 input (1.B 2.dB/dt)
-        x2 = torch.cat((x[:,:,0:1],x[:,:,2:3]),dim=2)
+        output = []
         for t in range(seq_size):
-            # RNN1 input (dB,state)       
-            self.rnn1_hx = self.rnn1(x[:,t,1:2], self.rnn1_hx)
+            H_total, self.rnn1_hx, self.rnn2_hx = self.step(x[:,t,:], var, self.rnn1_hx,
+                                                            self.rnn2_hx if t > 0 else None)
+            output.append(H_total.view(batch_size,1,self.output_size))
+        # Joined once, growing the output at every step copies it seq_size times
+        output = torch.cat(output,dim=1)
+
+        return self.loss_density(x[:, self.n_init:, 0:1], output[:, self.n_init:, :], var)
+
+    def forward_adaptive(self, x, var, tol=1e-3, quantile=1.0):
+        """
+        Network part of the forward function with an adaptive warm-up.
+
+        A shadow eddy cell started from the zero state runs alongside the warm-up steps. A waveform
+        counts as converged once the eddy field strengths of both differ by less than tol, i.e. its
+        eddy cells no longer depend on their initial state. The whole batch ends the warm-up as soon
+        as a share quantile of its waveforms converged, at the latest after n_init steps, and then
+        runs one period. The stop operators do not forget their initial state, so a shorter warm-up
+        changes the result: SydneyModel.set_warmup validates it against the fixed warm-up.
 
-            # DNN1 input (rnn1_hx,F,T)
-            dnn1_in = torch.cat((self.rnn1_hx,var[:,0:2]),dim=1) 
+        Parameters:
+        x: batch,seq,input_size
+            Input features (1.B, 2.dB, 3.dB/dt), as from get_dataloader
+        var: batch,var_size+operator_size
+            Supplementary inputs (1.F 2.T) and the operator initial state
+
+        Returns the loss density (batch), the unsmoothed field strength (batch,seq-n_init,1), the
+        number of warm-up steps and the converged waveforms (batch).
+        """
+        period = x.size(1)-self.n_init
+        rnn1_hx, rnn2_hx, shadow = var[:, 2:], None, None
+        converged = torch.zeros(x.size(0), dtype=torch.bool, device=x.device)
+        warmup = None
+        output = []
+        t = 0
+        while warmup is None or t < warmup+period:
+            H_total, rnn1_hx, rnn2_hx = self.step(x[:, t, :], var, rnn1_hx, rnn2_hx)
+            output.append(H_total)
+            t += 1
+            if warmup is not None:
+                continue
+            # Shadow eddy cell from the zero state
+            rnn2_in = torch.cat((x[:, t-1, 0:1], x[:, t-1, 2:3], var[:, 0:2]), dim=1)
+            shadow = self.rnn2(rnn2_in, torch.zeros_like(rnn2_hx) if shadow is None else shadow)
+            converged |= (self.dnn2(rnn2_hx)-self.dnn2(shadow)).abs()[:, 0] < tol
+            if t == self.n_init or converged.float().mean() >= quantile:
+                warmup = t
+        output = torch.stack(output[warmup:], dim=1)
+        Pv, H = self.loss_density(x[:, warmup:warmup+period, 0:1], output, var)
+        return Pv, H, warmup, converged
+
+    def loss_density(self, B, H, var):
+        """
+        Denormalize one period of B and H and integrate the loss density.
+
+        Parameters:
+        B: batch,seq,1
+            Normalized flux density
+        H: batch,seq,1
+            Normalized field strength
+        var: batch,var_size
+            Supplementary inputs (1.F 2.T)
+        """
+        B = (B*self.norm[0][1]+self.norm[0][0]) 
+        H = (H.float()*self.norm[1][1]+self.norm[1][0])
+        # Trapezoidal rule written out, since aten::trapz has no ONNX export
+        loop_area = torch.sum((H[:, 1:]+H[:, :-1])*(B[:, 1:]-B[:, :-1]), dim=1)/2
+        Pv = loop_area*(10**(var[:, 0:1]*self.norm[2][1]+self.norm[2][0]))
+        return torch.flatten(Pv), H
 
-            # H hysteresis prediction 
-            H_hyst_pred = self.dnn1(dnn1_in)
+    def step(self, x_t, var, rnn1_hx, rnn2_hx=None):
+        """
+        Advance the operator and eddy cell states by one time step.
+
+        Parameters:
+        x_t: batch,input_size
+            Input features of the step (1.B, 2.dB, 3.dB/dt)
+        var: batch,var_size(+operator_size)
+            Supplementary inputs (1.F 2.T)
+        rnn1_hx: batch,operator_size
+            Stop operator state
+        rnn2_hx: batch,hidden_size
+            Eddy cell state, None at the first step to initialize it from the hysteresis prediction
+
+        Returns the normalized field strength (batch,1) and the new states.
+        """
+        # RNN1 input (dB,state)       
+        rnn1_hx = self.rnn1(x_t[:,1:2], rnn1_hx)
 
-            # DNN2 input (B,dB/dt,T,F)
-            rnn2_in = torch.cat((x2[:,t,:],var[:,0:2]),dim=1) 
+        # DNN1 input (rnn1_hx,F,T)
+        dnn1_in = torch.cat((rnn1_hx,var[:,0:2]),dim=1) 
 
-            # Initialize second rnn state 
-            if t==0:
-                H_eddy_init = x[:,t,0:1]-H_hyst_pred
-                buffer = x.new_ones(x.size(0),self.hidden_size)
-                self.rnn2_hx = torch.autograd.Variable((buffer/torch.sum(self.dnn2.weight,dim=1))*H_eddy_init)
+        # H hysteresis prediction 
+        H_hyst_pred = self.dnn1(dnn1_in)
 
-            self.rnn2_hx = self.rnn2(rnn2_in, self.rnn2_hx)
+        # DNN2 input (B,dB/dt,T,F)
+        rnn2_in = torch.cat((x_t[:,0:1],x_t[:,2:3],var[:,0:2]),dim=1) 
 
-            # H eddy prediction
-            H_eddy = self.dnn2(self.rnn2_hx)
+        # Initialize second rnn state 
+        if rnn2_hx is None:
+            H_eddy_init = x_t[:,0:1]-H_hyst_pred
+            buffer = x_t.new_ones(x_t.size(0),self.hidden_size)
+            rnn2_hx = torch.autograd.Variable((buffer/torch.sum(self.dnn2.weight,dim=1))*H_eddy_init)
 
-            # H total 
-            H_total = (H_hyst_pred+H_eddy).view(batch_size,1,self.output_size)
+        rnn2_hx = self.rnn2(rnn2_in, rnn2_hx)
 
-            if t==0:
-                output = H_total
-            else:
-                output = torch.cat((output,H_total),dim=1)
+        # H eddy prediction
+        H_eddy = self.dnn2(rnn2_hx)
 
-        # Compute the power loss density 
-        B = (x[:,self.n_init:,0:1]*self.norm[0][1]+self.norm[0][0]) 
-        H = (output[:, self.n_init:,:]*self.norm[1][1]+self.norm[1][0])
-        Pv = torch.trapz(H, B, axis=1)*(10**(var[:, 0:1]*self.norm[2][1]+self.norm[2][0]))
+        # H total 
+        return H_hyst_pred+H_eddy, rnn1_hx, rnn2_hx
+
+    def postprocess(self, Pv, H, warmup=None):
+        """
+        Smooth the field strength and rotate it back to the start of the input cycle.
+
+        Parameters:
+        Pv: batch
+            Loss density from forward_raw
+        H: batch,seq-n_init,1
+            Unsmoothed field strength from forward_raw
+        warmup: int
+            Number of warm-up steps before H, n_init by default
+        """
+        from scipy.signal import savgol_filter  # only needed once H is materialized
 
-        # Return results
+        warmup = self.n_init if warmup is None else warmup
+        batch_size = H.size(0)
         H = savgol_filter(H.detach().to("cpu").numpy(), window_length=7, polyorder=2,axis=1)
         H = torch.from_numpy(H).view(batch_size,-1,1)
-        real_H = torch.cat((H[:, -self.n_init:, :],H[:, :-self.n_init, :]), dim=1)
+        real_H = torch.cat((H[:, H.size(1)-warmup:, :],H[:, :H.size(1)-warmup, :]), dim=1)
         return torch.flatten(Pv).cpu(), real_H[:, :, 0].cpu()
     
+class MMINetExport(torch.nn.Module):
+    """Expose MMINet.forward_raw as forward, which is what torch.onnx.export traces."""
+
+    def __init__(self, mdl):
+        super().__init__()
+        self.mdl = mdl
+
+    def forward(self, x, var):
+        """Forward function."""
+        return self.mdl.forward_raw(x, var)
+
+
+class OnnxMMINet():
+    """
+    ONNX Runtime session standing in for MMINet.
+
+    Parameters:
+    - onnx_model: graph file or bytes written by SydneyModel.export_onnx
+    - mdl: the float32 MMINet, used for its normalization data and post-processing
+    """
+
+    def __init__(self, onnx_model, mdl):
+        try:
+            import onnxruntime as ort
+        except ImportError as error:
+            raise ImportError("The 'onnxruntime' backend requires the onnxruntime package") from error
+        # Follow the torch thread settings in effect when the session is created
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = torch.get_num_interop_threads()
+        self.session = ort.InferenceSession(onnx_model, options, providers=["CPUExecutionProvider"])
+        self.mdl = mdl
+        self.norm = mdl.norm
+
+    def eval(self):
+        """Inference only, kept for interface compatibility with MMINet."""
+        return self
+
+    def forward_raw(self, x, var):
+        """Run the graph on the CPU, it returns the outputs of MMINet.forward_raw."""
+        Pv, H = self.session.run(None, {"x": x.cpu().numpy(), "var": var.cpu().numpy()})
+        return torch.from_numpy(Pv), torch.from_numpy(H)
+
+    def __call__(self, x, var):
+        """Run the graph and post-process its outputs like MMINet.forward."""
+        return self.mdl.postprocess(*self.forward_raw(x, var))
+
+
 class StopOperatorCell():
     """
     MMINN Sub-layer: Static hysteresis prediction using stop operators.
@@ -232,12 +816,13 @@ class StopOperatorCell():
         
     def sslu(self, X):
         """Hardsimoid-like or symmetric saturated linear unit definition."""
-        a = torch.ones_like(X)
-        return torch.max(-a,torch.min(a,X))
+        return torch.clamp(X, -1, 1)
     
     def __call__(self, dB, state):
         """Update operator of each time step."""
-        r = self.operator_thre.to(dB.device) 
+        if self.operator_thre.device != dB.device:
+            self.operator_thre = self.operator_thre.to(dB.device)
+        r = self.operator_thre
         output = self.sslu((dB + state)/r)*r
         return output.float()
   
@@ -275,7 +860,7 @@ class EddyCell(torch.nn.Module):
         return hidden
 
 
-def get_dataloader(data_B, data_F, data_T, norm, n_init=32):
+def get_dataloader(data_B, data_F, data_T, norm, n_init=32, batch_size=128):
     """
     Preprocess data into a data loader.
 
@@ -293,34 +878,66 @@ def get_dataloader(data_B, data_F, data_T, norm, n_init=32):
          B/F/T normalization data
     n_init : int
          Additional points for computing the history magnetization
+    batch_size : int
+         Rows per network batch
     """
     
     # Data pre-process 
-    # 1. Down-sample to 128 points 
+    # 1. Resample to 128 points (anti-aliased)
     seq_length = 128
 
-    cols = np.array(range(0,data_B.shape[1],round(data_B.shape[1]/seq_length)))
-    data_B = data_B[:, cols]
+    data_B = resample_periodic(data_B, seq_length)
     
-    # 2. Add extra points for initial magnetization calculation 
-    data_length = seq_length + n_init
-    data_B = np.hstack((data_B,data_B[:,1:1+n_init]))
-
-    # 3. Format data into tensors 
-    B = torch.from_numpy(data_B).view(-1, data_length, 1).float()
+    # 2. Format data into tensors (copies, the columnar inputs are read-only views)
+    B = torch.tensor(data_B, dtype=torch.float32)
     if np.isscalar(data_F):
         data_F = np.array([data_F])
     if np.isscalar(data_T):
         data_T = np.array([data_T])
-    T = torch.from_numpy(data_T).view(-1, 1).float()
+    T = torch.tensor(data_T, dtype=torch.float32).view(-1, 1)
     F = torch.from_numpy(np.log10(data_F)).view(-1,1).float()
 
-    # 4. Data Normalization 
+    # 3. Normalization, extra points for the initial magnetization and extra features
+    inputs, vars = get_features(B, F, T, norm, n_init)
+
+    # 4. Create dataloader to speed up data processing
+    test_dataset = torch.utils.data.TensorDataset(inputs, vars)
+    kwargs = {'num_workers': 0, 'batch_size': batch_size, 'drop_last': False}
+    test_loader = torch.utils.data.DataLoader(test_dataset, **kwargs)
+
+    return test_loader
+
+
+def get_features(B, F, T, norm, n_init=32):
+    """
+    Build the network inputs from one period of B, in PyTorch only so that gradients flow back.
+
+    Parameters
+    ---------
+    B : tensor (batch, seq_length)
+         One period of B in T at the model resolution
+    F : tensor (batch, 1)
+         Log10 of the frequency in Hz
+    T : tensor (batch, 1)
+         Temperature in °C
+    norm : list 
+         B/F/T normalization data
+    n_init : int
+         Additional points for computing the history magnetization
+
+    Returns the input features (batch, seq_length+n_init, 3) and the supplementary inputs with the
+    operator initial state (batch, 2+operator_size).
+    """
+    seq_length = B.size(1)
+    # Add extra points for initial magnetization calculation 
+    B = torch.cat((B, B[:, 1:1+n_init]), dim=1).unsqueeze(2)
+
+    # Data Normalization 
     in_B = (B-norm[0][0])/norm[0][1]
     in_F = (F-norm[2][0])/norm[2][1]
     in_T = (T-norm[3][0])/norm[3][1]
     
-    # 5. Extra features 
+    # Extra features 
     in_dB = torch.diff(in_B,dim=1)                     # Flux density change
     in_dB = torch.cat((in_dB[:, 0:1, :], in_dB), dim=1)
     
@@ -332,12 +949,43 @@ def get_dataloader(data_B, data_F, data_T, norm, n_init=32):
 
     s0 = get_operator_init(in_B[:, 0, 0]-in_dB[:, 0, 0], in_dB, max_B, min_B)  # Operator inital state
 
-    # 6. Create dataloader to speed up data processing
-    test_dataset = torch.utils.data.TensorDataset(torch.cat((in_B, in_dB, in_dB_dt), dim=2), torch.cat((in_F, in_T, s0),dim=1))
-    kwargs = {'num_workers': 0, 'batch_size': 128, 'drop_last': False}
-    test_loader = torch.utils.data.DataLoader(test_dataset, **kwargs)
+    # Scalar operating points apply to the whole batch
+    in_F, in_T = in_F.expand(s0.size(0), 1), in_T.expand(s0.size(0), 1)
+    return torch.cat((in_B, in_dB, in_dB_dt), dim=2), torch.cat((in_F, in_T, s0), dim=1)
 
-    return test_loader
+
+def calibration_waveforms(n=48, seed=0, seq_length=128):
+    """
+    Generate seeded sine, triangular and trapezoidal waveforms with operating points.
+
+    Used to validate reduced-precision modes against float32 before they are activated.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, seq_length, endpoint=False)
+    data_B = np.empty((n, seq_length))
+    for i in range(n):
+        if i % 3 == 0:
+            data_B[i] = np.sin(2*np.pi*t)
+        elif i % 3 == 1:
+            duty = rng.uniform(0.1, 0.9)
+            data_B[i] = np.interp(t, [0, duty, 1], [-1, 1, -1])
+        else:
+            duty1, duty2 = rng.uniform(0.1, 0.4, 2)
+            flat = (1-duty1-duty2)/2
+            data_B[i] = np.interp(t, np.cumsum([0, duty1, flat, duty2, flat]), [-1, 1, 1, -1, -1])
+        data_B[i] = np.roll(data_B[i], rng.integers(seq_length))
+    data_B *= rng.uniform(0.02, 0.25, (n, 1))
+    data_F = rng.uniform(50e3, 450e3, n)
+    data_T = rng.choice([25.0, 50.0, 70.0, 90.0], n)
+    return data_B, data_F, data_T
+
+
+def relative_errors(P, H, P_ref, H_ref):
+    """Maximum relative error of P and maximum peak-normalized error of H against a reference."""
+    return {
+        "p": float(np.max(np.abs(P - P_ref) / np.abs(P_ref))),
+        "h": float(np.max(np.max(np.abs(H - H_ref), axis=1) / np.max(np.abs(H_ref), axis=1))),
+    }
 
 
 # %% Predict the operator state at t0
@@ -360,25 +1008,18 @@ def get_operator_init(B0, dB, Bmax, Bmin, operator_size=30, max_out_H=1):
          The maximum output of field strength
     """
     # 1. Parameter setting
-    batch = dB.shape[0]
-    state = torch.zeros((batch, operator_size))
     operator_thre = torch.pow(torch.arange(1, operator_size+1, dtype=torch.float)/operator_size+1, torch.tensor(3.0)).view(1, -1)*max_out_H
+    r = operator_thre.to(dB.device)
+    B0, Bmax, Bmin = B0.reshape(-1, 1), Bmax.reshape(-1, 1), Bmin.reshape(-1, 1)
 
-    # 2. Iterate each excitation for the operator inital state computation
-    for i in range(B0.__len__()):
-        for j in range(operator_size):
-            r = operator_thre[0, j]
-            if (Bmax[i] >= r) or (Bmin[i] <= -r):
-                if dB[i, 0] >= 0:
-                    if B0[i] > Bmin[i]+2*r:
-                        state[i, j] = r
-                    else:
-                        state[i, j] = B0[i]-(r+Bmin[i])
-                else:
-                    if B0[i] < Bmax[i]-2*r:
-                        state[i, j] = -r
-                    else:
-                        state[i, j] = B0[i]+(r-Bmax[i])
+    # 2. Select the state of each excitation and operator (rising or falling flux density at t0)
+    rising = torch.where(B0 > Bmin+2*r, r, B0-(r+Bmin))
+    falling = torch.where(B0 < Bmax-2*r, -r, B0+(r-Bmax))
+    state = torch.where(dB[:, 0].reshape(-1, 1) >= 0, rising, falling)
+
+    # 3. Operators beyond the flux density range of the cycle stay demagnetized
+    reached = (Bmax >= r) | (Bmin <= -r)
+    state = torch.where(reached, state, torch.zeros_like(state))
 
     return state
 
@@ -0,0 +1,151 @@
+"""
+File contains the columnar (Arrow/Parquet) input and output of the team models.
+
+Measured waveforms are stored as Parquet with one fixed-size list column for B. Arrow keeps the
+values of such a column in one contiguous buffer, so a float32 column maps to an (N, L) NumPy view
+without any copy. The readers yield one (B, frequency, temperature) chunk per row group, which the
+predict_iter methods of the models consume lazily, and the writer appends P and H row group by row
+group, so datasets larger than the memory flow through with a bounded number of row groups in
+flight.
+
+Requires the pyarrow package (a dependency of streamlit).
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import numpy as np
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as error:
+        raise ImportError("Columnar input and output requires the pyarrow package") from error
+    return pa, pq
+
+
+def to_numpy(column):
+    """
+    Map a fixed-size list column to an (N, L) array.
+
+    Args:
+        column (pa.Array): A fixed-size list array or a chunked array of them, without nulls.
+
+    Return:
+        An (N, L) read-only view on the Arrow buffer for a single chunk of float32 or float64 values, otherwise a
+        copy of the values (several chunks, other value types as float32).
+    """
+    pa, _ = _pyarrow()
+    if isinstance(column, pa.ChunkedArray):
+        if column.num_chunks != 1:
+            column = column.combine_chunks()
+        else:
+            column = column.chunk(0)
+    if not pa.types.is_fixed_size_list(column.type):
+        raise TypeError(f"Expected a fixed-size list column, got {column.type}")
+    if column.null_count:
+        raise ValueError("The waveform column contains nulls")
+    values = column.flatten()  # the values of the rows in the slice, zero-copy
+    if values.type not in (pa.float32(), pa.float64()):
+        values = values.cast(pa.float32())
+    return values.to_numpy(zero_copy_only=values.null_count == 0).reshape(-1, column.type.list_size)
+
+
+def from_numpy(data):
+    """Wrap an (N, L) array as a fixed-size list array, zero-copy for C-contiguous arrays."""
+    pa, _ = _pyarrow()
+    data = np.ascontiguousarray(data)
+    return pa.FixedSizeListArray.from_arrays(pa.array(data.reshape(-1)), data.shape[1])
+
+
+def read_parquet(path, b_column="B", frequency="frequency", temperature="temperature", row_groups=None):
+    """
+    Read a Parquet file of waveforms row group by row group.
+
+    Args:
+        path (str): The Parquet file.
+        b_column (str): The fixed-size list column of B in T, one period per row.
+        frequency (str | float): The column of the frequency in Hz, or a value for all rows.
+        temperature (str | float): The column of the temperature in °C, or a value for all rows.
+        row_groups (list): The row groups to read, all by default.
+
+    Return:
+        A generator of (B, frequency, temperature) chunks, one per row group, with B an (N, L) view.
+    """
+    _, pq = _pyarrow()
+    parquet = pq.ParquetFile(path)
+    columns = [b_column] + [c for c in (frequency, temperature) if isinstance(c, str)]
+    for group in range(parquet.num_row_groups) if row_groups is None else row_groups:
+        table = parquet.read_row_group(group, columns=columns)
+        chunk = [to_numpy(table.column(b_column))]
+        for c in (frequency, temperature):
+            chunk.append(table.column(c).to_numpy() if isinstance(c, str) else c)
+        yield tuple(chunk)
+
+
+class ParquetWriter:
+    """
+    Write the results of the models to Parquet, one row group per chunk.
+
+    Parameters:
+    - path: the Parquet file
+    - h: whether to write the H column; otherwise only P is written and H is never materialized
+    - compression: the Parquet compression codec
+    """
+
+    def __init__(self, path, h=True, compression="snappy"):
+        _pyarrow()  # fail before the first chunk is predicted
+        self.path = path
+        self.h = h
+        self.compression = compression
+        self.writer = None
+        self.rows = 0
+
+    def write(self, p, h=None):
+        """Append the loss densities (N,) in W/m³ and field strengths (N, L) in A/m of one chunk."""
+        pa, pq = _pyarrow()
+        columns = {"P": pa.array(np.atleast_1d(np.asarray(p, dtype=np.float64)))}
+        if self.h:
+            columns["H"] = from_numpy(np.atleast_2d(h))
+        table = pa.table(columns)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def predict_parquet(mdl, source, destination, h=True, depth=2, **columns):
+    """
+    Run a model on a Parquet file of waveforms and write P (and H) to another Parquet file.
+
+    The row groups are read, preprocessed and predicted as a pipeline (see predict_iter), and each one is
+    written as one row group of the destination, in the order of the source.
+
+    Args:
+        mdl: A team model.
+        source (str): The Parquet file of waveforms, see read_parquet for the column keywords.
+        destination (str): The Parquet file of the results.
+        h (bool): Whether to write H; otherwise the models run in loss-only mode.
+        depth (int): The number of prepared row groups that may wait for the network.
+
+    Return:
+        The number of rows written.
+    """
+    with ParquetWriter(destination, h=h) as writer:
+        for result in mdl.predict_iter(read_parquet(source, **columns), loss_only=not h, depth=depth):
+            if h:
+                writer.write(*result)
+            else:
+                writer.write(result.p)
+        return writer.rows
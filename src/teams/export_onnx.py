@@ -0,0 +1,80 @@
+"""
+File contains the ONNX export pipeline of the team models.
+
+One graph is written per (team, material) to <out>/<team>/<material>.onnx and checked against
+the PyTorch outputs with ONNX Runtime before it is reported as exported.
+
+Usage:
+    python src/teams/export_onnx.py --out onnx
+    python src/teams/export_onnx.py --teams Sydney --materials N87 3C90
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import argparse
+import sys
+
+from os import makedirs
+from os.path import abspath, dirname, join
+
+TEAMS_DIR = dirname(abspath(__file__))
+for team in ("Paderborn", "Sydney"):
+    sys.path.insert(0, join(TEAMS_DIR, team))
+
+from Paderborn import PaderbornModel
+from Sydney import SydneyModel
+
+TEAMS = {
+    "Paderborn": PaderbornModel,
+    "Sydney": SydneyModel,
+}
+MATERIALS = ['3C90', '3C92', '3C94', '3C95', '3E6',
+             '3F4', '77', '78', '79', 'ML95S',
+             'N27', 'N30', 'N49', 'N87', 'T37']
+
+
+def export(team, material, out):
+    """
+    Export and verify the graph of one team model.
+
+    Args:
+        team (string): The name of the team.
+        material (string): The name of the material.
+        out (string): The output root folder.
+    """
+    mdl = TEAMS[team](join(TEAMS_DIR, team, "models", material + ".pt"), material)
+    makedirs(join(out, team), exist_ok=True)
+    onnx_path = join(out, team, material + ".onnx")
+    mdl.export_onnx(onnx_path)
+
+    # Raises a ValueError if the graph does not reproduce the PyTorch outputs
+    errors = mdl.set_backend("onnxruntime", onnx_path)
+    return onnx_path, errors
+
+
+def main():
+    """
+    Export entry point.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", nargs="+", default=list(TEAMS), choices=list(TEAMS))
+    parser.add_argument("--materials", nargs="+", default=MATERIALS, choices=MATERIALS)
+    parser.add_argument("--out", default=join(TEAMS_DIR, "onnx"), help="output root folder")
+    args = parser.parse_args()
+
+    failed = 0
+    for team in args.teams:
+        for material in args.materials:
+            try:
+                onnx_path, errors = export(team, material, args.out)
+                print(f"{team:9s} {material:5s} -> {onnx_path} (P err {errors['p']:.1e}, H err {errors['h']:.1e})")
+            except ValueError as error:
+                failed += 1
+                print(f"{team:9s} {material:5s} FAILED: {error}")
+    sys.exit(1 if failed else 0)
+
+
+# Main program
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+File contains the pipelined execution of the team models on large batches.
+
+A model call consists of a preprocessing stage (resampling, feature engineering and tensor
+construction, mostly NumPy and torch kernels that release the GIL) and an inference stage (the
+network). For large batches the rows are split into chunks: a background thread prepares chunk k+1
+while the calling thread runs the network on chunk k. The number of chunks in flight is bounded, so
+memory stays bounded and the throughput approaches the cost of the slower stage. The same pipeline
+streams iterables of chunks larger than the memory through the predict_iter methods of the models.
+
+Given a memory budget, the chunk size follows from the peak memory per row of each stage, measured
+once on a probe chunk: workers chunks in preparation, depth prepared chunks and the chunk in
+inference must fit in the budget.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import ctypes
+import queue
+import sys
+import threading
+import tracemalloc
+
+import numpy as np
+
+_DONE = object()
+
+
+def split_batch(data_B, frequency, temperature, chunk_size):
+    """
+    Split a batch into chunks of rows.
+
+    Args:
+        data_B (np.array): The flux density of shape (N, L).
+        frequency (np.array): The frequency, scalar or of shape (N,).
+        temperature (np.array): The temperature, scalar or of shape (N,).
+        chunk_size (int): The number of rows per chunk.
+
+    Return:
+        A generator of (B, frequency, temperature) chunks, with the operating points broadcast to the rows.
+    """
+    n = len(data_B)
+    # Materialized, read-only broadcast views become non-writable tensors in the models
+    frequency = np.broadcast_to(np.asarray(frequency).reshape(-1), (n,)).copy()
+    temperature = np.broadcast_to(np.asarray(temperature).reshape(-1), (n,)).copy()
+    for first in range(0, n, chunk_size):
+        rows = slice(first, first + chunk_size)
+        yield data_B[rows], frequency[rows], temperature[rows]
+
+
+def as_chunk(item, frequency=None, temperature=None):
+    """
+    Normalize one item of a chunk iterable to a (B, frequency, temperature) chunk.
+
+    Args:
+        item (object): A (B, frequency, temperature) tuple, or only the flux density of shape (N, L) or (L,)
+            (array, np.memmap slice, DataFrame, ...) for the default operating points.
+        frequency (np.array): The default frequency in Hz, scalar or per row.
+        temperature (np.array): The default temperature in °C, scalar or per row.
+    """
+    if isinstance(item, tuple) and len(item) == 3:
+        data_B, frequency, temperature = item
+    else:
+        data_B = item
+    if frequency is None or temperature is None:
+        raise ValueError("chunks without operating points need the default frequency and temperature")
+    return np.atleast_2d(np.asarray(data_B)), frequency, temperature
+
+
+def pipelined(prepare, infer, chunks, depth=2, workers=1, ordered=True):
+    """
+    Overlap the preprocessing of the next chunks with the inference of the current one.
+
+    prepare runs in `workers` background threads and hands its results to infer, which runs in the
+    calling thread. The input chunks are consumed lazily, and at most depth+workers of them are in
+    flight (taken from the input but not yet inferred), so memory stays bounded whatever the size of
+    the input: when the consumer is slow the producers block (back-pressure). Closing the generator
+    stops the producers. Exceptions of the input or of either stage are raised in the calling thread.
+
+    Args:
+        prepare (function): The preprocessing stage, called with one chunk.
+        infer (function): The inference stage, called with one prepared chunk.
+        chunks (iterable): The input chunks.
+        depth (int): The number of prepared chunks that may wait for inference.
+        workers (int): The number of preprocessing threads.
+        ordered (bool): Yield the results in the order of the chunks. Otherwise (index, result) pairs are
+            yielded as soon as the chunks are prepared.
+
+    Return:
+        A generator of the inference results.
+    """
+    prepared = queue.Queue()
+    in_flight = threading.BoundedSemaphore(depth + workers)
+    stop = threading.Event()
+    source = enumerate(chunks)
+    source_lock = threading.Lock()
+
+    def acquire():
+        # Wait for a free slot, unless the consumer went away
+        while not stop.is_set():
+            if in_flight.acquire(timeout=0.1):
+                return True
+        return False
+
+    def produce():
+        try:
+            while acquire():
+                with source_lock:
+                    index, chunk = next(source, (None, _DONE))
+                if chunk is _DONE:
+                    in_flight.release()
+                    break
+                prepared.put((index, prepare(chunk), None))
+        except BaseException as error:  # handed over to the consumer
+            prepared.put((None, None, error))
+        prepared.put((None, _DONE, None))
+
+    producers = [threading.Thread(target=produce, name=f"magnet-prepare-{i}", daemon=True)
+                 for i in range(workers)]
+    for producer in producers:
+        producer.start()
+    try:
+        finished = 0
+        pending = {}
+        next_index = 0
+        while finished < workers:
+            index, item, error = prepared.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                finished += 1
+                continue
+            if not ordered:
+                result = infer(item)
+                in_flight.release()
+                yield index, result
+                continue
+            # Chunks prepared out of order wait for their predecessors
+            pending[index] = item
+            while next_index in pending:
+                result = infer(pending.pop(next_index))
+                in_flight.release()
+                next_index += 1
+                yield result
+    finally:
+        stop.set()
+        for producer in producers:
+            producer.join()
+
+
+def _status(key):
+    """A memory figure of /proc/self/status in bytes."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(key):
+                return int(line.split()[1])*1024
+    raise KeyError(key)
+
+
+def peak_memory(function, *args):
+    """
+    Run a function and measure its peak memory.
+
+    On Linux with glibc the freed heap pages are returned and the peak resident set size of the
+    process is reset before the call, which covers the NumPy, pandas and torch allocations.
+    Elsewhere only the allocations traced by tracemalloc (NumPy and pandas, not torch) are seen.
+    Other threads allocating during the call are counted as well.
+
+    Return:
+        The result of the call and its peak memory in bytes above the memory at the start.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            # Return the freed heap pages first, otherwise memory reused from earlier calls is missed
+            ctypes.CDLL(None).malloc_trim(0)
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")  # reset the peak resident set size
+            start = _status("VmRSS")
+            result = function(*args)
+            return result, max(_status("VmHWM")-start, 0)
+        except (OSError, AttributeError):  # no glibc or no access to /proc
+            pass
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    try:
+        result = function(*args)
+        return result, max(tracemalloc.get_traced_memory()[1]-start, 0)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+
+def probe_chunk(rows, seq_len):
+    """A chunk of sinusoidal periods at 100 mT, 100 kHz and 25 °C for the memory measurements."""
+    data_B = np.tile(0.1*np.sin(2*np.pi*np.arange(seq_len)/seq_len), (rows, 1))
+    return data_B, np.full(rows, 100e3), np.full(rows, 25.0)
+
+
+def row_memory(prepare, infer, rows, seq_len):
+    """
+    Measure the peak memory per row of the preprocessing and inference stages.
+
+    The stages run once on a probe chunk before the measurement, so that lazy initializations are
+    not counted. Fixed costs are spread over the rows of the probe, which overestimates the memory
+    of larger chunks.
+
+    Return:
+        The bytes per row of prepare and of infer.
+    """
+    chunk = probe_chunk(rows, seq_len)
+    infer(prepare(chunk))
+    prepared, prepare_peak = peak_memory(prepare, chunk)
+    _, infer_peak = peak_memory(infer, prepared)
+    return prepare_peak/rows, infer_peak/rows
+
+
+def budget_rows(memory_budget, prepare_row, infer_row, depth=2, workers=1):
+    """
+    The number of rows per chunk that keeps a pipeline within a memory budget.
+
+    Args:
+        memory_budget (int): The working memory in bytes, on top of the inputs and results.
+        prepare_row (float): The peak memory per row of the preprocessing, also bounding a prepared chunk.
+        infer_row (float): The peak memory per row of the inference.
+        depth (int): The number of prepared chunks that may wait for inference.
+        workers (int): The number of preprocessing threads.
+    """
+    return max(1, int(memory_budget // ((depth+workers)*prepare_row+infer_row)))
@@ -0,0 +1,47 @@
+"""
+File contains the result object of the loss-only call mode shared by the team models.
+
+Many sweeps only need the loss density. In the loss-only mode the models return P at once and keep
+the raw network output of H; its post-processing (rescaling, smoothing, rotation, resampling and
+casting) only runs when H is first accessed, or never.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+
+
+class Prediction:
+    """
+    Loss density computed at once and field strength materialized on first access.
+
+    Unpacks like the (p, h) tuple of the regular call. Dropping the object before accessing h frees
+    the raw network output without ever post-processing it.
+
+    Parameters:
+    - p: the loss density in W/m³
+    - materialize: function returning H in A/m, called at most once
+    """
+
+    def __init__(self, p, materialize):
+        self.p = p
+        self._materialize = materialize
+        self._h = None
+
+    @property
+    def h(self):
+        """The field strength in A/m, post-processed on first access."""
+        if self._materialize is not None:
+            self._h = self._materialize()
+            self._materialize = None
+        return self._h
+
+    @property
+    def materialized(self):
+        """Whether H has been post-processed."""
+        return self._materialize is None
+
+    def __iter__(self):
+        yield self.p
+        yield self.h
+
+    def __repr__(self):
+        return f"Prediction(p={self.p!r}, h={'materialized' if self.materialized else 'lazy'})"
@@ -0,0 +1,172 @@
+"""
+File contains the waveform preprocessing shared by the team models.
+
+The models expect exactly one period at a fixed resolution (1024 samples for Paderborn, 128 for
+Sydney). The stages here bring batches of arbitrary waveforms to that form.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import numpy as np
+
+
+def resample_periodic(x, n):
+    """
+    Resample periodic sequences to n samples per period with the FFT.
+
+    Each row holds exactly one period, without repeating the first sample at the end. Decimation
+    drops the harmonics above the Nyquist frequency of the target (anti-aliasing), interpolation
+    evaluates the band-limited trigonometric interpolant. Sequences already at n samples are
+    returned unchanged.
+
+    Torch tensors are resampled with torch.fft, so gradients flow through the resampling.
+
+    Args:
+        x (np.array): The sequences of shape (N, L) or (L,), or a floating point torch tensor.
+        n (int): The number of samples per period.
+
+    Return:
+        The resampled sequences of shape (N, n) or (n,).
+    """
+    tensor = type(x).__module__.startswith("torch")
+    x = x if tensor else np.asarray(x)
+    length = x.shape[-1]
+    if length == n:
+        return x
+    bins = min(length, n) // 2 + 1
+    nyquist = 1.0
+    if n < length and n % 2 == 0:
+        # The Nyquist bin of the target carries both the positive and the negative frequency
+        nyquist = 2.0
+    elif n > length and length % 2 == 0:
+        # The Nyquist bin of the source becomes an ordinary bin shared by two frequencies
+        nyquist = 0.5
+
+    if tensor:
+        import torch
+
+        spectrum = torch.fft.rfft(x, dim=-1)[..., :bins]
+        weight = torch.ones(bins, dtype=x.dtype, device=x.device)
+        weight[-1] = nyquist
+        return torch.fft.irfft(spectrum * weight, n, dim=-1) * (n / length)
+
+    dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+    spectrum = np.fft.rfft(x, axis=-1)[..., :bins]
+    spectrum[..., -1] *= nyquist
+    return (np.fft.irfft(spectrum, n, axis=-1) * (n / length)).astype(dtype, copy=False)
+
+
+def _as_records(records):
+    """Return the records as a list of 1D arrays, or a 2D array if they share their length."""
+    if isinstance(records, (list, tuple)) and len({len(record) for record in records}) > 1:
+        return [np.asarray(record) for record in records]
+    records = np.asarray(records) if not isinstance(records, np.ndarray) else records
+    return records.reshape(1, -1) if records.ndim == 1 else records
+
+
+def estimate_period(records, max_fft=2**18, max_samples=2**20):
+    """
+    Estimate the fundamental period of multi-cycle records, e.g. oscilloscope captures.
+
+    The peak of the Hann-windowed spectrum of the first max_fft samples gives a coarse period,
+    interpolated between the FFT bins. For longer records the phase drift of the fundamental between
+    the first and the last segment refines it over the whole record, so the error does not
+    accumulate over millions of samples.
+
+    Args:
+        records (np.array): The records of shape (N, L), at least two periods long (np.memmap works).
+        max_fft (int): The maximum number of samples per record transformed at once.
+        max_samples (int): The working memory bound in samples, records are processed in chunks.
+
+    Return:
+        The periods of shape (N,) in samples.
+    """
+    records = _as_records(records)
+    if isinstance(records, list):
+        return np.concatenate([estimate_period(record, max_fft, max_samples) for record in records])
+    length = records.shape[1]
+    window = np.hanning(min(length, max_fft))
+    size = len(window)
+    chunk = max(1, max_samples // size)
+    if len(records) > chunk:
+        return np.concatenate([estimate_period(records[first:first + chunk], max_fft, max_samples)
+                               for first in range(0, len(records), chunk)])
+
+    # Coarse estimate from the spectral peak (DC and the first bin leak into each other)
+    prefix = np.asarray(records[:, :size], dtype=float)
+    spectrum = np.abs(np.fft.rfft((prefix - prefix.mean(axis=1, keepdims=True)) * window, axis=1))
+    spectrum[:, :2] = 0
+    rows = np.arange(len(records))
+    k = np.clip(np.argmax(spectrum, axis=1), 2, spectrum.shape[1] - 2)
+    # Gaussian interpolation of the peak between the bins
+    a, b, c = (np.log(spectrum[rows, k + shift] + 1e-300) for shift in (-1, 0, 1))
+    curvature = a - 2 * b + c
+    offset = np.divide(0.5 * (a - c), curvature, out=np.zeros_like(b), where=curvature < 0)
+    period = size / (k + offset)
+    if np.any(length < 2 * period):
+        raise ValueError("records must contain at least two periods")
+    if length <= size:
+        return period
+
+    # Refinement from the phase drift between the first and the last segment
+    segment = min(size, length // 2)
+    samples = np.arange(segment)
+    carrier = np.hanning(segment) * np.exp(-2j * np.pi * samples / period[:, None])
+    start = np.sum(np.asarray(records[:, :segment], dtype=float) * carrier, axis=1)
+    end = np.sum(np.asarray(records[:, length - segment:], dtype=float) * carrier, axis=1)
+    distance = length - segment
+    drift = np.angle(end / start) / (2 * np.pi)
+    cycles = np.round(distance / period - drift) + drift
+    return distance / cycles
+
+
+def average_cycles(records, period, n, max_samples=2**20):
+    """
+    Average all complete cycles of each record into one period of n samples.
+
+    Cycles are sampled by linear interpolation at the (fractional) period, starting at the first
+    sample of the record. At most max_samples interpolated values are held at once, so memory does
+    not grow with the record length.
+
+    Args:
+        records (np.array): The records of shape (N, L) (np.memmap works).
+        period (np.array): The periods of shape (N,) in samples.
+        n (int): The number of samples of the averaged period.
+        max_samples (int): The working memory bound in samples.
+
+    Return:
+        The averaged periods of shape (N, n).
+    """
+    records = _as_records(records)
+    period = np.broadcast_to(np.asarray(period, dtype=float), (len(records),))
+    phase = np.arange(n) / n
+    cycles_per_chunk = max(1, max_samples // n)
+    averaged = np.empty((len(records), n))
+    for i, record in enumerate(records):
+        cycles = int((len(record) - 1) // period[i])
+        total = np.zeros(n)
+        for first in range(0, cycles, cycles_per_chunk):
+            positions = (np.arange(first, min(first + cycles_per_chunk, cycles))[:, None] + phase) * period[i]
+            index = positions.astype(int)
+            weight = positions - index
+            total += np.sum(record[index] * (1 - weight) + record[index + 1] * weight, axis=0)
+        averaged[i] = total / cycles
+    return averaged
+
+
+def extract_period(records, n, sample_rate=None, max_fft=2**18, max_samples=2**20):
+    """
+    Reduce multi-cycle records to one representative period each.
+
+    Args:
+        records (np.array): The records of shape (N, L) or a list of records of different lengths.
+        n (int): The number of samples of the period, e.g. the model resolution.
+        sample_rate (float): The sample rate in Hz, to return the frequency instead of the period.
+        max_fft (int): See estimate_period.
+        max_samples (int): The working memory bound in samples (see estimate_period and average_cycles).
+
+    Return:
+        The averaged periods of shape (N, n), and the periods in samples or the frequencies in Hz.
+    """
+    period = estimate_period(records, max_fft, max_samples)
+    averaged = average_cycles(records, period, n, max_samples)
+    return averaged, period if sample_rate is None else sample_rate / period
@@ -4,7 +4,7 @@ File contains grab-bag of utility functions and objects.
 Source: https://github.com/moetomg/magnet-engine
 """
 import altair as alt 
-import magnethub as mh
+import numpy as np
 
 from pandas import DataFrame
 
@@ -16,6 +16,9 @@ def load_model(model, material):
         model (torch.nn): The trained core loss model. 
         material (string): The name of the material.
     """    
+    # Deferred to the first model load, importing magnethub (and torch) dominates the start-up of the GUI
+    import magnethub as mh
+
     mdl = mh.loss.LossModel(material, model)
     return mdl
 
@@ -78,15 +81,73 @@ def draw_donut(input_response, input_text, input_color, range=[50,450]):
     ).properties(width=128, height=128)
     return plot_bg + plot + text
 
-def draw_line(flux, field, time=None):
+def lttb(points, n_out):
+    """
+    Select the indices of a shape-preserving subset of a curve (largest-triangle-three-buckets).
+
+    The first and last points are kept. The inner points are split into n_out - 2 buckets in
+    sequence order, and each bucket keeps the point spanning the largest triangle with the point
+    kept in the previous bucket and the mean of the next bucket.
+
+    Args:
+        points (np.array): The curve of shape (N, 2), in sequence order and comparable axis scales.
+        n_out (int): The number of points to keep.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    previous = points[0]
+    for i in range(n_out - 2):
+        bucket = points[edges[i]:edges[i + 1]]
+        following = points[edges[i + 1]:edges[i + 2]].mean(axis=0) if i < n_out - 3 else points[-1]
+        # Twice the triangle areas (previous, candidate, following)
+        area = np.abs((previous[0] - following[0]) * (bucket[:, 1] - previous[1])
+                      - (previous[0] - bucket[:, 0]) * (following[1] - previous[1]))
+        indices[i + 1] = edges[i] + np.argmax(area)
+        previous = points[indices[i + 1]]
+    return indices
+
+def normalize(values):
+    """
+    Scale a sequence to the unit range for comparable plot axes.
+
+    Args:
+        values (np.array): The sequence.
+    """
+    values = np.asarray(values, dtype=float)
+    span = values.max() - values.min()
+    return (values - values.min()) / span if span > 0 else values * 0
+
+def draw_line(flux, field, time=None, max_points=256):
     """
     Draw a line plot to visualize B-H curves.
+
+    Longer sequences are downsampled to max_points with LTTB for display only, which keeps the
+    chart payload small while preserving peaks and corners.
     
     Args:
         flux (np.array): The magnetic flux density (B).
         field (np.array): The magnetic field strength (H).
         time (np.array): The time sequence (t).
+        max_points (int): The maximum number of displayed points per curve (None keeps all).
     """ 
+    # Downsample the displayed curves
+    if max_points is not None and len(flux) > max_points:
+        if time is not None:
+            # Both traces share the rows, so keep the points selected for either of them
+            index = np.union1d(lttb(np.column_stack([time, normalize(flux)]), max_points // 2),
+                               lttb(np.column_stack([time, normalize(field)]), max_points // 2))
+            time = np.asarray(time)[index]
+        else:
+            index = lttb(np.column_stack([normalize(field), normalize(flux)]), max_points)
+        flux = np.asarray(flux)[index]
+        field = np.asarray(field)[index]
+
     # Define the dataframe 
     df = DataFrame(columns=['t', 'B', 'H'])
     df['t'] = time
@@ -0,0 +1,16 @@
+"""
+File contains the shared setup of the tests of the team models.
+
+The benchmark helpers put src and the team directories on the path, the shared team modules
+(columnar, pipeline, preprocessing) live in src/teams.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import sys
+
+from os.path import abspath, dirname, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+for path in (join(ROOT, "benchmarks"), join(ROOT, "src", "teams")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
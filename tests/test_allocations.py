@@ -0,0 +1,27 @@
+"""
+File contains the tests of the steady-state allocations of the team models (see benchmarks/allocations.py).
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+from argparse import Namespace
+
+import pytest
+import torch
+
+from allocations import run
+from common import TEAMS
+
+
+@pytest.mark.parametrize("team", TEAMS)
+def test_steady_state(team):
+    """Repeated calls do not allocate more over time, and out= writes P and H without allocating them."""
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)  # the intra-op pool would add its own allocations
+    try:
+        args = Namespace(teams=[team], materials=["N87"], batch_sizes=[1, 100], warmup=2, calls=3,
+                         tolerance=0.05, seed=0)
+        records, failures = run(args)
+    finally:
+        torch.set_num_threads(threads)
+    assert {record["mode"] for record in records} == {"fresh", "out"}
+    assert failures == []
@@ -0,0 +1,43 @@
+"""
+File contains the tests of the columnar (Parquet) input and output of the team models.
+
+Source: https://github.com/moetomg/magnet-engine
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+from common import RESOLUTION, TEAMS, generate_waveforms, load_team_model
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from columnar import from_numpy, predict_parquet  # noqa: E402
+
+
+@pytest.fixture(scope="module", params=TEAMS)
+def team(request):
+    return request.param, load_team_model(request.param, "N87")
+
+
+@pytest.mark.parametrize("h", [True, False])
+def test_predict_parquet_model_resolution(team, h, tmp_path):
+    """Rows already at the model resolution reach the models as read-only Arrow views, without warnings."""
+    name, mdl = team
+    B, F, T = generate_waveforms("trapezoidal", 64, RESOLUTION[name], seed=0)
+    B = B.astype(np.float32)
+    source, destination = tmp_path / "waveforms.parquet", tmp_path / "results.parquet"
+    pq.write_table(pa.table({"B": from_numpy(B), "frequency": F, "temperature": T}), source, row_group_size=32)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        rows = predict_parquet(mdl, str(source), str(destination), h=h)
+
+    assert rows == len(B)
+    table = pq.read_table(destination)
+    P, H = mdl(B, F, T)
+    np.testing.assert_allclose(table.column("P").to_numpy(), np.reshape(P, -1), rtol=1e-5)
+    if h:
+        written = table.column("H").combine_chunks().flatten().to_numpy().reshape(len(B), -1)
+        np.testing.assert_allclose(written, H, rtol=1e-5, atol=1e-3)